@@ -1,10 +1,11 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import torch
-import cv2
 import os
 from model import DecoderCNN
-from werkzeug.utils import secure_filename
+import ecc
+from backends import load_weights
+from utils import decode_image_bytes
 import numpy as np
 
 app = Flask(__name__)
@@ -17,39 +18,22 @@ CORS(app, resources={r"/*": {"origins": [
 ]}}, supports_credentials=True)
 
 
-UPLOAD_FOLDER = "uploads"
 CHECKPOINTS = "checkpoints"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
 
-# ---------------- ECC Decode ----------------
-def hamming_decode(block):
-    if len(block)<7:
-        block += [0]*(7-len(block))
-    p1,p2,d0,p3,d1,d2,d3 = block
-    c1 = p1 ^ d0 ^ d1 ^ d3
-    c2 = p2 ^ d0 ^ d2 ^ d3
-    c3 = p3 ^ d1 ^ d2 ^ d3
-    error_pos = c1 + (c2<<1) + (c3<<2)
-    if error_pos != 0 and error_pos <=7:
-        block[error_pos-1] ^=1
-    return [d0,d1,d2,d3]
-
-def bits_to_str(bits):
-    chars = []
-    for i in range(0, len(bits), 8):
-        byte = bits[i:i+8]
-        chars.append(chr(int("".join(map(str,byte)),2)))
-    return ''.join(chars).rstrip('\x00')
+# Loaded once at startup (mmap'd weights, CPU to avoid MPS issues)
+_decoder = None
+
+def get_decoder():
+    global _decoder
+    if _decoder is None:
+        _decoder = load_weights(DecoderCNN(), os.path.join(CHECKPOINTS, "decoder.pth")).cpu().eval()
+    return _decoder
 
+# ---------------- ECC Decode ----------------
 def ecc_decode_payload(payload_tensor):
-    bits = (payload_tensor.squeeze().detach().cpu().numpy()>0.5).astype(int)
-    decoded_bits = []
-    for i in range(0, len(bits), 7):
-        block = bits[i:i+7]
-        decoded_bits.extend(hamming_decode(block.tolist()))
-    return bits_to_str(decoded_bits)
+    return ecc.decode_payloads(payload_tensor.reshape(1, -1), ecc=True)[0]
 
 # -------------------- Flask Route --------------------
 @app.route("/api/decode", methods=["POST"])
@@ -59,23 +43,15 @@ def decode_image():
             return jsonify({"error":"No image uploaded"}), 400
 
         file = request.files["image"]
-        filename = secure_filename(file.filename)
-        upload_path = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(upload_path)
 
-        # Load image
-        img = cv2.imread(upload_path, cv2.IMREAD_COLOR)
-        if img is None:
+        # Decode in memory
+        try:
+            img_rgb = decode_image_bytes(file.read())
+        except ValueError:
             return jsonify({"error":"Invalid image file"}),400
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         img_tensor = torch.FloatTensor(img_rgb/255.0).permute(2,0,1).unsqueeze(0)
 
-        # Load decoder on CPU to avoid MPS issues
-        decoder = DecoderCNN()
-        state = torch.load(os.path.join(CHECKPOINTS, "decoder.pth"), map_location="cpu")
-        decoder.load_state_dict(state)
-        decoder.eval()
-        decoder = decoder.cpu()
+        decoder = get_decoder()
         img_tensor = img_tensor.cpu()
 
         # Decode
@@ -108,4 +84,5 @@ def decode_image():
 
 if __name__ == "__main__":
     print(f"Running decoder on CPU for stability")
+    get_decoder()
     app.run(debug=True, port=5001)
\ No newline at end of file
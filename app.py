@@ -1,15 +1,33 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
-import datetime
+import io
+import hashlib
+import shutil
+import tempfile
+import base64
+from urllib.parse import quote
 import traceback
-import cv2
-import torch
-
-# Import your model classes
-from model import EncoderCNN, DecoderCNN
+import threading
+import numpy as np
+
+# Models, batchers and metadata helpers live in service.py (shared with the workers)
+import service
+from service import (DECODER_BACKEND, INFERENCE_SOCKETS, bytes_to_payload_tensor, decode_bgr_images, device,
+                     embed_bgr_image, encode_metadata_plain, ensure_models, load_models, payload_is_clean,
+                     payload_tensor_to_string, register_payload, registry_match, run_decoder_batch,
+                     run_encoder_batch, split_metadata, warmup)
+from cache import ResultCache
+from jobs import JobManager
+from video import VIDEO_BATCH_SIZE, VIDEO_DECODE_EVERY, decode_video, embed_video
+from fused import bgr_to_tensor
+from progressive import decode_progressive
+import metrics
+from metrics import span
+from utils import (IMAGE_FORMATS, decode_image_bytes, encode_image, negotiate_format, save_unique,
+                   wants_image_response)
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": [
@@ -18,105 +36,97 @@ CORS(app, resources={r"/*": {"origins": [
     "http://127.0.0.1:3000",
     "http://localhost:5000",
     "http://127.0.0.1:5000",
-]}}, supports_credentials=True)
+]}}, supports_credentials=True, expose_headers=["X-Fingerprint-Metadata", "Server-Timing"])
 
 # --- Folders & paths ---
 UPLOAD_FOLDER = "uploads"
 RESULT_FOLDER = "fingerprinted"
-CHECKPOINTS = "checkpoints"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULT_FOLDER, exist_ok=True)
 
-# --- Device handling ---
-if torch.cuda.is_available():
-    device = torch.device("cuda")
-elif torch.backends.mps.is_available():
-    device = torch.device("mps")
-else:
-    device = torch.device("cpu")
-
-# Globals for models (lazy-loaded)
-_encoder = None
-_decoder = None
-_decoder_cpu = None  # CPU fallback for MPS issues
-
-PAYLOAD_SIZE = 1024  # must match your training
-
-# --- Model loading ---
-def load_models():
-    """Load encoder/decoder checkpoints and prepare models."""
-    global _encoder, _decoder, _decoder_cpu
-
-    enc_path = os.path.join(CHECKPOINTS, "encoder.pth")
-    dec_path = os.path.join(CHECKPOINTS, "decoder.pth")
-
-    if not os.path.exists(enc_path) or not os.path.exists(dec_path):
-        raise FileNotFoundError("encoder.pth or decoder.pth not found in checkpoints/")
-
-    enc_state = torch.load(enc_path, map_location="cpu")
-    dec_state = torch.load(dec_path, map_location="cpu")
-
-    _encoder = EncoderCNN()
-    _encoder.load_state_dict(enc_state)
-    _encoder.to(device).eval()
-
-    _decoder = DecoderCNN(payload_size=PAYLOAD_SIZE)
-    _decoder.load_state_dict(dec_state)
-    _decoder.to(device).eval()
-
-    if device.type == "mps":
-        _decoder_cpu = DecoderCNN(payload_size=PAYLOAD_SIZE)
-        _decoder_cpu.load_state_dict(dec_state)
-        _decoder_cpu.to(torch.device("cpu")).eval()
-
-# --- Metadata helpers ---
-def encode_metadata_plain(username: str) -> bytes:
-    """Return raw bytes of 'username|YYYY-MM-DD HH:MM:SS'."""
-    dt = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    meta = f"{username}|{dt}"
-    return meta.encode("utf-8")
-
-def bytes_to_payload_tensor(b: bytes, device_target):
-    """Convert metadata bytes → payload tensor (1, PAYLOAD_SIZE)."""
-    bits = []
-    for byte in b:
-        bits.extend([int(bit) for bit in format(byte, "08b")])
-    bits = bits[:PAYLOAD_SIZE]
-    bits += [0] * (PAYLOAD_SIZE - len(bits))
-    return torch.FloatTensor(bits).unsqueeze(0).to(device_target)
-
-def payload_tensor_to_string(tensor):
-    """Convert decoder output tensor → UTF-8 metadata string."""
-    arr = (tensor.squeeze().detach().cpu().round().int().tolist())
-    if isinstance(arr, int):
-        arr = [arr]
-    bytes_list = []
-    for i in range(0, len(arr), 8):
-        bytebits = arr[i:i+8]
-        if len(bytebits) < 8:
-            bytebits += [0]*(8-len(bytebits))
-        val = int("".join(map(str, bytebits)), 2)
-        bytes_list.append(val)
-    raw = bytes(bytes_list).rstrip(b"\x00")
-    return raw.decode("utf-8", errors="ignore")
-
-# --- Image helpers ---
-def read_image_cv2(path):
-    img = cv2.imread(path, cv2.IMREAD_COLOR)
-    if img is None:
-        raise ValueError("Failed to read image")
-    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-def tensor_from_rgb_image(img_rgb, device_target):
-    """Convert HxWx3 RGB → tensor (1,3,H,W) normalized to 0..1."""
-    t = torch.FloatTensor(img_rgb.astype("float32") / 255.0).permute(2, 0, 1).unsqueeze(0)
-    return t.to(device_target), img_rgb.shape[:2]
-
-def save_rgb_to_file(img_rgb, out_path):
-    cv2.imwrite(out_path, cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR))
+# Uploads are decoded and results encoded in memory. Set PERSIST_FILES=1 to also
+# keep them in UPLOAD_FOLDER/RESULT_FOLDER under unique names, each folder
+# pruned oldest-first to MAX_STORED_MB.
+PERSIST_FILES = os.environ.get("PERSIST_FILES", "0") == "1"
+MAX_STORED_BYTES = int(float(os.environ.get("MAX_STORED_MB", "512")) * 2**20)
+
+# --- Result cache ---
+# Re-submitting the same pixels for the same user returns the stored result
+# without running the encoder. With CACHE_KEY_TIMESTAMP=1 the embed timestamp
+# is part of the key, so only resubmissions within the same second hit.
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join(".cache", "results"))
+RESULT_CACHE_MB = float(os.environ.get("RESULT_CACHE_MB", "256"))
+RESULT_CACHE_DISK_MB = float(os.environ.get("RESULT_CACHE_DISK_MB", "1024"))
+CACHE_KEY_TIMESTAMP = os.environ.get("CACHE_KEY_TIMESTAMP", "0") == "1"
+result_cache = ResultCache(int(RESULT_CACHE_MB * 2**20), RESULT_CACHE_DIR, int(RESULT_CACHE_DISK_MB * 2**20))
+
+# PROGRESSIVE_DECODE=1 makes /api/decode try downscaled levels and crops before
+# full resolution (see progressive.py); clients can override with mode=progressive|full.
+# Without PAYLOAD_ECC=1 the early exit rests on the metadata framing check alone.
+PROGRESSIVE_DECODE = os.environ.get("PROGRESSIVE_DECODE", "0") == "1"
+
+# --- Bulk jobs ---
+# /api/bulk work runs in BULK_WORKERS spawned processes with BULK_THREADS
+# intra-op threads each; at most BULK_MAX_JOBS jobs are worked on at once, so
+# interactive /api/embed keeps most of the cores. Only one server process
+# (elected through a lock in BULK_DIR) runs the pool. Zip uploads may expand to
+# at most BULK_MAX_EXPANDED_MB per job.
+BULK_DIR = os.environ.get("BULK_DIR", os.path.join(".cache", "jobs"))
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", "1"))
+BULK_THREADS = int(os.environ.get("BULK_THREADS", str(max(1, (os.cpu_count() or 1) // 4))))
+BULK_MAX_JOBS = int(os.environ.get("BULK_MAX_JOBS", "2"))
+BULK_MAX_EXPANDED_MB = float(os.environ.get("BULK_MAX_EXPANDED_MB", "2048"))
+bulk_jobs = JobManager(BULK_DIR, workers=BULK_WORKERS, threads_per_worker=BULK_THREADS,
+                       max_running_jobs=BULK_MAX_JOBS,
+                       max_expanded_bytes=int(BULK_MAX_EXPANDED_MB * 2**20))
+
+# --- Startup ---
+# Importing app loads nothing and starts no threads (bench.py, tests and the
+# tools import it freely); models load lazily on the first request. Only the
+# server entry points -- `python app.py` and the create_app() WSGI factory --
+# call start_background(), where EAGER_LOAD picks how models load: "background"
+# loads + warms up in a thread (see /api/ready), "sync" does it before
+# returning (use with pre-forking servers such as gunicorn --preload, so
+# workers share the mmap'd weights), "off" keeps loading lazy.
+EAGER_LOAD = os.environ.get("EAGER_LOAD", "background")
+
+def result_cache_key(img_bgr, username, meta_bytes, fmt, quality):
+    """Hash of the decoded pixels + payload + embed settings + output encoding.
+
+    The settings part (service.embed_settings_key) changes when encoder.pth is
+    replaced or PAYLOAD_ECC / the tiling settings change, so on-disk entries
+    from an earlier configuration are never served.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(service.embed_settings_key().encode())
+    h.update(repr(img_bgr.shape).encode())
+    h.update(np.ascontiguousarray(img_bgr).data)
+    h.update(meta_bytes if CACHE_KEY_TIMESTAMP else username.encode("utf-8"))
+    h.update(f"|{fmt}|{quality}".encode())
+    return h.hexdigest()
+
+def fingerprint_response(out_bytes, mimetype, out_name, metadata, stored=None):
+    """Stream the encoded result, or wrap it in JSON.
+
+    Clients that accept image/* (or send response=image) get the encoded image
+    with the metadata in X-Fingerprint-Metadata. JSON clients get a data URL,
+    or the stored filename when PERSIST_FILES is on.
+    """
+    if wants_image_response(request):
+        resp = send_file(io.BytesIO(out_bytes), mimetype=mimetype, download_name=out_name)
+        resp.headers["X-Fingerprint-Metadata"] = quote(metadata, safe="|:- ")  # percent-encoded UTF-8
+        return resp
+
+    body = {"metadata": metadata}
+    if stored:
+        body["fingerprinted_image"] = stored
+    else:
+        body["image_data"] = f"data:{mimetype};base64,{base64.b64encode(out_bytes).decode('ascii')}"
+    return jsonify(body)
 
 # --- API endpoints ---
 @app.route("/api/embed", methods=["POST", "OPTIONS"])
+@metrics.instrument("embed")
 def api_embed():
     if request.method == "OPTIONS":
         return "", 200
@@ -126,65 +136,88 @@ def api_embed():
 
         file = request.files["image"]
         username = request.form.get("username", "anonymous")
-        filename = secure_filename(file.filename)
-        upload_path = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(upload_path)
-
-        if _encoder is None or _decoder is None:
-            load_models()
-
-        img_rgb = read_image_cv2(upload_path)
-        img_tensor, _ = tensor_from_rgb_image(img_rgb, device)
-
+        filename = secure_filename(file.filename) or "image"
+        with span("read_upload"):
+            data = file.read()
+        if PERSIST_FILES:
+            with span("persist_upload"):
+                save_unique(UPLOAD_FOLDER, filename, data, MAX_STORED_BYTES)
+
+        img_bgr = decode_image_bytes(data, bgr=True)
+        metrics.set_image_size(*img_bgr.shape[:2])
         meta_bytes = encode_metadata_plain(username)
-        payload = bytes_to_payload_tensor(meta_bytes, device)
-
-        with torch.no_grad():
-            watermarked = _encoder(img_tensor, payload)
-
-        wm_np = (watermarked.squeeze().permute(1, 2, 0).cpu().numpy() * 255.0).clip(0, 255).astype("uint8")
-        out_path = os.path.join(RESULT_FOLDER, f"fingerprinted_{filename}")
-        save_rgb_to_file(wm_np, out_path)
-
-        return jsonify({
-            "fingerprinted_image": f"fingerprinted_{filename}",
-            "metadata": meta_bytes.decode("utf-8")
-        })
+        fmt, quality = negotiate_format(request)
+        out_name = f"fingerprinted_{os.path.splitext(filename)[0]}{IMAGE_FORMATS[fmt][1]}"
+
+        with span("cache_lookup"):
+            cache_key = result_cache_key(img_bgr, username, meta_bytes, fmt, quality)
+            hit = result_cache.get(cache_key)
+        if hit is not None:
+            out_bytes, info = hit
+            stored = info.get("stored")
+            if PERSIST_FILES and not (stored and os.path.exists(os.path.join(RESULT_FOLDER, stored))):
+                stored = save_unique(RESULT_FOLDER, out_name, out_bytes, MAX_STORED_BYTES)
+            return fingerprint_response(out_bytes, info["mimetype"], out_name, info["metadata"], stored)
+
+        ensure_models()
+        with span("register"):
+            register_payload(meta_bytes)
+
+        wm_bgr = embed_bgr_image(img_bgr, meta_bytes)
+        metadata = meta_bytes.decode("utf-8")
+        out_bytes, mimetype = encode_image(wm_bgr, fmt, quality, bgr=True)
+
+        stored = None
+        if PERSIST_FILES:
+            with span("persist_result"):
+                stored = save_unique(RESULT_FOLDER, out_name, out_bytes, MAX_STORED_BYTES)
+        with span("cache_store"):
+            result_cache.put(cache_key, out_bytes, {"metadata": metadata, "mimetype": mimetype, "stored": stored})
+        return fingerprint_response(out_bytes, mimetype, out_name, metadata, stored)
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/decode", methods=["POST"])
+@metrics.instrument("decode")
 def api_decode():
     try:
         if "image" not in request.files:
             return jsonify({"error": "No image uploaded"}), 400
 
         file = request.files["image"]
-        filename = secure_filename(file.filename)
-        upload_path = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(upload_path)
-
-        if _encoder is None or _decoder is None:
-            load_models()
-
-        img_rgb = read_image_cv2(upload_path)
-        img_tensor, _ = tensor_from_rgb_image(img_rgb, device)
-
-        if device.type == "mps":
-            with torch.no_grad():
-                payload_pred = _decoder_cpu(img_tensor.cpu())
+        filename = secure_filename(file.filename) or "image"
+        with span("read_upload"):
+            data = file.read()
+        if PERSIST_FILES:
+            with span("persist_upload"):
+                save_unique(UPLOAD_FOLDER, filename, data, MAX_STORED_BYTES)
+
+        ensure_models()
+
+        img_bgr = decode_image_bytes(data, bgr=True)
+        metrics.set_image_size(*img_bgr.shape[:2])
+        mode = request.values.get("mode", "progressive" if PROGRESSIVE_DECODE else "full")
+        if mode == "progressive":
+            with span("progressive_decode"):
+                payload_pred, level = decode_progressive(decode_bgr_images, img_bgr, payload_is_clean)
+        elif INFERENCE_SOCKETS:
+            with span("forward"):
+                payload_pred = decode_bgr_images([img_bgr])
+            level = {"level": "full", "attempts": ["full"]}
         else:
-            with torch.no_grad():
-                payload_pred = _decoder(img_tensor)
-
-        decoded_meta = payload_tensor_to_string(payload_pred)
-        fingerprint, timestamp = ("", "")
-        if "|" in decoded_meta:
-            fingerprint, timestamp = decoded_meta.split("|", 1)
-        else:
-            fingerprint = decoded_meta
+            with span("to_tensor"):
+                img_tensor = bgr_to_tensor(img_bgr, device)
+            with span("forward"):  # includes the wait for the micro-batch
+                payload_pred = service._decode_batcher(img_tensor)
+            level = {"level": "full", "attempts": ["full"]}
+
+        with span("payload_to_string"):
+            decoded_meta = payload_tensor_to_string(payload_pred)
+        fingerprint, timestamp = split_metadata(decoded_meta)
+        with span("registry_lookup"):
+            match = registry_match(payload_pred)
 
         return jsonify({
             "decoded_data": {
@@ -194,17 +227,178 @@ def api_decode():
                 "security_level": "Military Grade",
                 "origin": "Digital Fingerprint System v2.1",
                 "checksum": "0x12345678"
-            }
+            },
+            "registry_match": match,
+            "decode_level": level["level"],
+            "decode_attempts": level["attempts"],
         })
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+def video_unsupported():
+    """Video runs the models in-process, so front ends in INFERENCE_SOCKETS mode (no models) refuse it."""
+    if INFERENCE_SOCKETS:
+        return jsonify({"error": "Video is not served in inference-server mode (INFERENCE_SOCKETS); "
+                                 "use a server without it or video.py"}), 501
+    return None
+
+def save_video_upload(file):
+    """VideoCapture needs a path: spool the upload into a fresh temp directory."""
+    tmp_dir = tempfile.mkdtemp(prefix="video_")
+    ext = os.path.splitext(secure_filename(file.filename or ""))[1] or ".mp4"
+    src = os.path.join(tmp_dir, "input" + ext)
+    file.save(src)
+    return tmp_dir, src
+
+@app.route("/api/video/embed", methods=["POST"])
+@metrics.instrument("video_embed")
+def api_video_embed():
+    refused = video_unsupported()
+    if refused:
+        return refused
+    if "video" not in request.files:
+        return jsonify({"error": "No video uploaded"}), 400
+    tmp_dir = None
+    try:
+        file = request.files["video"]
+        username = request.form.get("username", "anonymous")
+        tmp_dir, src = save_video_upload(file)
+
+        load_models()
+
+        meta_bytes = encode_metadata_plain(username)
+        payload = bytes_to_payload_tensor(meta_bytes, device)
+        register_payload(meta_bytes)
+        dst = os.path.join(tmp_dir, "fingerprinted.mp4")
+        batch_size = request.form.get("batch_size", VIDEO_BATCH_SIZE, type=int)
+        frames = embed_video(run_encoder_batch, src, dst, payload, batch_size)
+
+        name = f"fingerprinted_{os.path.splitext(secure_filename(file.filename or '') or 'video')[0]}.mp4"
+        resp = send_file(dst, mimetype="video/mp4", download_name=name)
+        resp.headers["X-Fingerprint-Metadata"] = quote(meta_bytes.decode("utf-8"), safe="|:- ")
+        resp.headers["X-Frames"] = str(frames)
+        resp.call_on_close(lambda: shutil.rmtree(tmp_dir, ignore_errors=True))
+        return resp
+    except Exception as e:
+        traceback.print_exc()
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/video/decode", methods=["POST"])
+@metrics.instrument("video_decode")
+def api_video_decode():
+    refused = video_unsupported()
+    if refused:
+        return refused
+    if "video" not in request.files:
+        return jsonify({"error": "No video uploaded"}), 400
+    tmp_dir = None
+    try:
+        tmp_dir, src = save_video_upload(request.files["video"])
+
+        load_models()
+
+        every = max(1, request.form.get("every", VIDEO_DECODE_EVERY, type=int))
+        max_frames = request.form.get("max_frames", None, type=int)
+        bits, info = decode_video(run_decoder_batch, src, every, VIDEO_BATCH_SIZE, max_frames, device)
+        fingerprint, timestamp = split_metadata(payload_tensor_to_string(bits))
+        return jsonify({
+            "decoded_data": {"fingerprint": fingerprint, "timestamp": timestamp},
+            "registry_match": registry_match(bits),
+            "frames_sampled": info["frames_sampled"],
+            "sample_every": every,
+            "bit_agreement": info["bit_agreement"],
+        })
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+@app.route("/api/bulk", methods=["POST"])
+@metrics.instrument("bulk_submit")
+def api_bulk_submit():
+    """Queue many images (or .zip archives) under field 'images'; returns a job id immediately."""
+    try:
+        files = request.files.getlist("images") or request.files.getlist("image")
+        if not files:
+            return jsonify({"error": "No images uploaded"}), 400
+        username = request.form.get("username", "anonymous")
+        fmt, _ = negotiate_format(request)
+        job_id = bulk_jobs.submit([(f.filename or "", f.read()) for f in files], username, fmt)
+        return jsonify(bulk_jobs.status(job_id)), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/bulk/<job_id>")
+def api_bulk_status(job_id):
+    status = bulk_jobs.status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(status)
+
+@app.route("/api/bulk/<job_id>/download")
+def api_bulk_download(job_id):
+    if bulk_jobs.status(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    path = bulk_jobs.archive_path(job_id)
+    if path is None:
+        return jsonify({"error": "Job not finished"}), 409
+    return send_file(path, mimetype="application/zip", download_name=f"fingerprinted_{job_id}.zip")
+
+@app.route("/api/cache/stats")
+def api_cache_stats():
+    return jsonify(result_cache.snapshot())
+
+@app.route("/api/ready")
+def api_ready():
+    readiness = service._readiness
+    status = 200 if readiness["ready"] else 503
+    return jsonify(dict(readiness, device=str(device), decoder_backend=DECODER_BACKEND)), status
+
+@app.route("/metrics")
+def api_metrics():
+    """Prometheus text exposition: stage histograms, in-flight requests, queues, load time, memory."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/fingerprinted/<filename>")
 def serve_fingerprinted(filename):
     return send_from_directory(RESULT_FOLDER, filename)
 
+# --- Metrics gauges ---
+metrics.register_gauge("fingerprint_batch_queue_depth", "Requests waiting in a micro-batcher.",
+                       lambda: {(("queue", b.name),): b.qsize() for b in (service._embed_batcher, service._decode_batcher) if b})
+metrics.register_gauge("fingerprint_model_load_seconds", "Time to load the model weights.",
+                       lambda: service._readiness["load_seconds"])
+metrics.register_gauge("fingerprint_warmup_seconds", "Time spent on warmup forwards.",
+                       lambda: service._readiness["warmup_seconds"])
+metrics.register_gauge("fingerprint_ready", "1 once models are loaded and warmed up.",
+                       lambda: int(service._readiness["ready"]))
+metrics.register_gauge("fingerprint_result_cache", "Result cache counters and sizes.",
+                       lambda: {(("field", k),): v for k, v in result_cache.snapshot().items()})
+
+def start_background():
+    """Start model warmup (per EAGER_LOAD) and the bulk-job dispatcher for this server process."""
+    if EAGER_LOAD == "sync":
+        warmup()
+    elif EAGER_LOAD == "background":
+        threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    bulk_jobs.start()  # resume jobs queued before a restart
+
+def create_app():
+    """WSGI factory: `gunicorn 'app:create_app()'` (add --preload with EAGER_LOAD=sync)."""
+    start_background()
+    return app
+
 if __name__ == "__main__":
     print(f"Running on device: {device}")
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    start_background()
+    # The reloader in debug mode imports (and loads the models) twice; opt in with FLASK_DEBUG=1.
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG", "0") == "1", threaded=True)
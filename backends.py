@@ -0,0 +1,111 @@
+# backends.py
+import json
+import os
+
+import torch
+
+from model import DecoderCNN, LiteDecoderCNN
+
+# Artifacts written by export_decoder.py
+DECODER_ARTIFACTS = {
+    "float": "decoder.pth",
+    "int8": "decoder_int8.pt",          # TorchScript, dynamically quantized fc
+    "int8-static": "decoder_int8_static.pt",  # TorchScript, conv + fc quantized
+    "torchscript": "decoder_script.pt",
+    "onnx": "decoder.onnx",
+}
+
+
+def load_state_mmap(path):
+    """torch.load with mmap=True so CPU tensors alias the file's pages.
+
+    Pre-forked server workers that load the same checkpoint then share one
+    physical copy through the page cache. Falls back to a regular load for
+    legacy (non-zip) checkpoints or torch versions without mmap support.
+    """
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except (TypeError, RuntimeError):
+        return torch.load(path, map_location="cpu")
+
+
+def load_weights(module, path):
+    """Load a checkpoint into module, keeping mmap-backed tensors instead of copying them."""
+    state = load_state_mmap(path)
+    try:
+        module.load_state_dict(state, assign=True)
+    except TypeError:  # torch < 2.1
+        module.load_state_dict(state)
+    return module
+
+
+class OnnxDecoder:
+    """Callable wrapper so an ONNX Runtime session can stand in for DecoderCNN."""
+
+    def __init__(self, path, num_threads=0):
+        import onnxruntime as ort  # optional dependency, only needed for this backend
+        opts = ort.SessionOptions()
+        if num_threads:
+            opts.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        out = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(out)
+
+    def eval(self):
+        return self
+
+
+# --- Decoder variants ---
+# Lighter decoders written by distill_decoder.py, recorded with their measured
+# latency, size and bit accuracy; each is served by name like a backend.
+VARIANTS_FILE = "decoder_variants.json"
+
+
+def read_variants(checkpoints="checkpoints"):
+    """{name: entry} from <checkpoints>/decoder_variants.json (empty if none were registered)."""
+    path = os.path.join(checkpoints, VARIANTS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)["variants"]
+
+
+def register_variant(name, entry, checkpoints="checkpoints"):
+    """Add or replace one variant in the registry file (written atomically)."""
+    variants = read_variants(checkpoints)
+    variants[name] = entry
+    path = os.path.join(checkpoints, VARIANTS_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"variants": variants}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def load_decoder_variant(name, checkpoints="checkpoints", payload_size=1024):
+    entry = read_variants(checkpoints)[name]
+    if entry["arch"]["payload_size"] != payload_size:
+        raise ValueError(f"Decoder variant {name!r} decodes {entry['arch']['payload_size']} bits, not {payload_size}")
+    path = os.path.join(checkpoints, entry["path"])
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found for decoder variant {name!r}; run distill_decoder.py first")
+    return load_weights(LiteDecoderCNN(**entry["arch"]), path).eval()
+
+
+def load_decoder_backend(name, checkpoints="checkpoints", payload_size=1024):
+    """Load a decoder by backend or registered variant name. Everything except "float" runs on CPU."""
+    if name not in DECODER_ARTIFACTS:
+        if name in read_variants(checkpoints):
+            return load_decoder_variant(name, checkpoints, payload_size)
+        choices = sorted(DECODER_ARTIFACTS) + sorted(read_variants(checkpoints))
+        raise ValueError(f"Unknown decoder backend {name!r}; choose from {choices}")
+    path = os.path.join(checkpoints, DECODER_ARTIFACTS[name])
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run export_decoder.py first")
+
+    if name == "float":
+        return load_weights(DecoderCNN(payload_size=payload_size), path).eval()
+    if name == "onnx":
+        return OnnxDecoder(path)
+    return torch.jit.load(path, map_location="cpu").eval()
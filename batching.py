@@ -0,0 +1,142 @@
+# batching.py
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+
+
+# Threads do not survive fork(): restart every scheduler loop in a pre-forked
+# server worker that inherited batchers created by the master process.
+_batchers = weakref.WeakSet()
+
+
+def _restart_after_fork():
+    for batcher in list(_batchers):
+        batcher._start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+class _Request:
+    __slots__ = ("image", "payload", "size", "key", "future")
+
+    def __init__(self, image, payload, size, key):
+        self.image = image
+        self.payload = payload
+        self.size = size
+        self.key = key
+        self.future = Future()
+
+
+def padded_size(h, w, multiple):
+    """Round (h, w) up to the next multiple used for bucketing."""
+    if multiple <= 1:
+        return h, w
+    return -(-h // multiple) * multiple, -(-w // multiple) * multiple
+
+
+class MicroBatcher:
+    """Collect single-image requests and run them through a model in batches.
+
+    Requests that arrive within ``max_delay_ms`` of the first queued request are
+    grouped by padded resolution; each bucket goes through ``run_batch`` in one
+    forward pass (at most ``max_batch_size`` images, replicate-padded to the
+    largest of them) and the results are split back out per request.
+
+    ``run_batch(images, payloads)`` receives a (B,3,H,W) tensor and either a
+    (B,P) payload tensor or None. If it returns images, each result is cropped
+    back to its original size; otherwise the b-th row is returned.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_delay_ms=5.0, pad_multiple=1, name="batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_delay = max(0.0, float(max_delay_ms)) / 1000.0
+        self.pad_multiple = max(1, int(pad_multiple))
+        self.name = name
+        self._start()
+        _batchers.add(self)
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, args=(self._queue,), name=self.name, daemon=True)
+        self._thread.start()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def submit(self, image, payload=None):
+        """Queue a (1,3,H,W) image (and optional (1,P) payload); returns a Future."""
+        h, w = image.shape[-2:]
+        key = padded_size(h, w, self.pad_multiple)
+        if payload is not None:
+            key = key + (payload.shape[-1],)
+        req = _Request(image, payload, (h, w), key)
+        self._queue.put(req)
+        return req.future
+
+    def __call__(self, image, payload=None):
+        return self.submit(image, payload).result()
+
+    # --- Scheduler loop ---
+    def _collect(self, q):
+        pending = [q.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(q.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return pending
+
+    def _loop(self, q):
+        while True:
+            buckets = defaultdict(list)
+            for req in self._collect(q):
+                buckets[req.key].append(req)
+            for reqs in buckets.values():
+                for i in range(0, len(reqs), self.max_batch_size):
+                    self._run(reqs[i:i + self.max_batch_size])
+
+    def _run(self, reqs):
+        try:
+            # Pad only up to the largest image in the bucket, not to the bucket's multiple:
+            # a lone request (or a bucket of equal sizes) runs unpadded, exactly as unbatched.
+            th = max(req.size[0] for req in reqs)
+            tw = max(req.size[1] for req in reqs)
+            images = []
+            for req in reqs:
+                h, w = req.size
+                img = req.image
+                if (h, w) != (th, tw):
+                    img = F.pad(img, (0, tw - w, 0, th - h), mode="replicate")
+                images.append(img)
+            batch = torch.cat(images, dim=0)
+            payloads = None
+            if reqs[0].payload is not None:
+                payloads = torch.cat([req.payload for req in reqs], dim=0)
+
+            with torch.no_grad():
+                out = self.run_batch(batch, payloads)
+
+            for b, req in enumerate(reqs):
+                res = out[b:b + 1]
+                if res.dim() == 4:
+                    h, w = req.size
+                    res = res[..., :h, :w]
+                req.future.set_result(res)
+        except Exception as e:
+            for req in reqs:
+                if not req.future.done():
+                    req.future.set_exception(e)
@@ -0,0 +1,312 @@
+"""Performance benchmarks for the models, the ECC codec, the fingerprint registry and the HTTP endpoints.
+
+    python bench.py run                       # all suites → results/bench_<time>.json
+    python bench.py run --suites model ecc --save-baseline
+    python bench.py run --suites registry --registry-sizes 1000000 2000000
+    python bench.py compare                   # latest run vs results/baseline.json
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+RESULTS_DIR = "results"
+BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+PAYLOAD_SIZE = 1024
+
+
+# --- Measurement helpers ---
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    """Sample process RSS in a background thread; ``peak_mb`` is the rise over the start value."""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak_mb = 0.0
+
+    def __enter__(self):
+        self._base = _rss_bytes()
+        self._peak = self._base
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self._peak = max(self._peak, _rss_bytes())
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._peak = max(self._peak, _rss_bytes())
+        self.peak_mb = (self._peak - self._base) / 2**20
+
+
+def time_call(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def summarize(times, items=1):
+    ms = sorted(t * 1000 for t in times)
+    pct = lambda q: ms[min(len(ms) - 1, int(round(q * (len(ms) - 1))))]
+    return {
+        "latency_ms": statistics.median(ms),
+        "p90_ms": pct(0.90),
+        "p99_ms": pct(0.99),
+        "throughput": items / (statistics.median(ms) / 1000),
+    }
+
+
+# --- Suites ---
+def bench_models(resolutions, batch_sizes, threads, repeats):
+    import torch
+    from backends import load_weights
+    from model import EncoderCNN, DecoderCNN
+
+    encoder, decoder = EncoderCNN().eval(), DecoderCNN(payload_size=PAYLOAD_SIZE).eval()
+    for model, name in ((encoder, "encoder.pth"), (decoder, "decoder.pth")):
+        try:
+            load_weights(model, os.path.join("checkpoints", name))
+        except Exception:
+            pass  # speed does not depend on the weights
+
+    results = {}
+    for t in threads:
+        torch.set_num_threads(t)
+        for res in resolutions:
+            for b in batch_sizes:
+                img = torch.rand(b, 3, res, res)
+                payload = torch.randint(0, 2, (b, PAYLOAD_SIZE)).float()
+                for name, fn in (("encoder", lambda: encoder(img, payload)), ("decoder", lambda: decoder(img))):
+                    with torch.no_grad(), PeakMemory() as mem:
+                        times = time_call(fn, repeats)
+                    stats = summarize(times, items=b)
+                    stats["peak_mb"] = mem.peak_mb
+                    results[f"model/{name}/{res}px/b{b}/t{t}"] = stats
+                    print(f"{name:8s} {res:5d}px b={b:<3d} t={t:<3d} {stats['latency_ms']:9.2f} ms "
+                          f"{stats['throughput']:8.1f} img/s  peak +{mem.peak_mb:.0f} MB")
+    return results
+
+
+def bench_ecc(counts, repeats):
+    import ecc
+    results = {}
+    for n in counts:
+        msgs = [f"user{i:06d}|2026-01-01 00:00:00" for i in range(n)]
+        for use_ecc in (False, True):
+            label = "hamming" if use_ecc else "plain"
+            bits = ecc.encode_payloads(msgs, PAYLOAD_SIZE, ecc=use_ecc)
+            enc = summarize(time_call(lambda: ecc.encode_payloads(msgs, PAYLOAD_SIZE, ecc=use_ecc), repeats), n)
+            dec = summarize(time_call(lambda: ecc.decode_payloads(bits, ecc=use_ecc), repeats), n)
+            results[f"ecc/encode/{label}/n{n}"] = enc
+            results[f"ecc/decode/{label}/n{n}"] = dec
+            print(f"ecc {label:7s} n={n:<6d} encode {enc['latency_ms']:8.3f} ms  decode {dec['latency_ms']:8.3f} ms")
+    return results
+
+
+def registry_messages(n, rng, users=10000):
+    """n 'username|YYYY-MM-DD HH:MM:SS' strings as the service issues them: a pool of users, a year of timestamps."""
+    alphabet = np.array(list("abcdefghijklmnopqrstuvwxyz0123456789"))
+    names = ["".join(rng.choice(alphabet, k)) for k in rng.integers(4, 13, users)]
+    now = np.datetime64(time.strftime("%Y-%m-%dT%H:%M:%S"), "s")
+    stamps = now - rng.integers(0, 365 * 24 * 3600, n).astype("timedelta64[s]")
+    stamps = np.char.replace(np.datetime_as_string(stamps, unit="s"), "T", " ")
+    return [f"{names[u]}|{t}" for u, t in zip(rng.integers(0, users, n), stamps)]
+
+
+def bench_registry(sizes, queries, flips):
+    import ecc
+    from registry import FingerprintRegistry
+
+    results = {}
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        msgs = registry_messages(n, rng)
+        bits = ecc.encode_payloads(msgs, PAYLOAD_SIZE, ecc=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            registry = FingerprintRegistry(os.path.join(tmp, "registry.db"), payload_size=PAYLOAD_SIZE)
+            t0 = time.perf_counter()
+            for start in range(0, n, 100000):
+                registry.bulk_add([(bits[i], msgs[i]) for i in range(start, min(n, start + 100000))])
+            print(f"registry n={n}: inserted in {time.perf_counter() - t0:.1f}s")
+            for k in flips:
+                # Flip k bits inside the metadata and a few in the padding, like a noisy decode.
+                picks = rng.integers(0, n, queries)
+                batch = []
+                for i in picks:
+                    q = bits[i].copy()
+                    q[rng.choice(8 * len(msgs[i].encode()), k, replace=False)] ^= 1
+                    q[rng.choice(np.arange(512, PAYLOAD_SIZE), 8, replace=False)] ^= 1
+                    batch.append(q)
+                it = iter(batch + batch[:1])  # time_call runs one warmup call first
+                stats = summarize(time_call(lambda: registry.nearest(next(it)), queries))
+                stats["matched"] = float(np.mean([registry.nearest(q)["metadata"] == msgs[i]
+                                                  for q, i in zip(batch, picks)]))
+                results[f"registry/nearest/n{n}/flips{k}"] = stats
+                print(f"registry n={n:<8d} {k:2d} flips  p50 {stats['latency_ms']:7.3f} ms  "
+                      f"p90 {stats['p90_ms']:7.3f} ms  p99 {stats['p99_ms']:7.3f} ms  "
+                      f"matched {stats['matched']:.3f}")
+    return results
+
+
+def bench_http(resolutions, requests_per_size):
+    import cv2
+    # Measure real inference: no result cache, no disk writes, and the registry and
+    # bulk queue in a scratch directory rather than the server's .cache. app and
+    # service read these settings on import (which starts no warmup thread).
+    scratch = tempfile.mkdtemp(prefix="bench-http-")
+    os.environ.update(RESULT_CACHE_MB="0", RESULT_CACHE_DISK_MB="0", PERSIST_FILES="0",
+                      RESULT_CACHE_DIR=os.path.join(scratch, "results"),
+                      REGISTRY_PATH=os.path.join(scratch, "registry.db"),
+                      BULK_DIR=os.path.join(scratch, "jobs"))
+    try:
+        import app as server
+        server.load_models()
+        client = server.app.test_client()
+
+        rng = np.random.default_rng(0)
+        results = {}
+        for res in resolutions:
+            img = rng.integers(0, 256, (res, res, 3), dtype=np.uint8)
+            png = cv2.imencode(".png", img)[1].tobytes()
+            for endpoint in ("/api/embed", "/api/decode"):
+                def call():
+                    resp = client.post(endpoint, data={"image": (io.BytesIO(png), "bench.png"),
+                                                       "username": "bench"},
+                                       headers={"Accept": "image/png"}, content_type="multipart/form-data")
+                    if resp.status_code != 200:
+                        raise RuntimeError(f"{endpoint} returned {resp.status_code}: {resp.get_data(as_text=True)}")
+                stats = summarize(time_call(call, requests_per_size))
+                results[f"http{endpoint}/{res}px"] = stats
+                print(f"{endpoint:12s} {res:5d}px p50 {stats['latency_ms']:8.2f} ms  p90 {stats['p90_ms']:8.2f} ms  "
+                      f"p99 {stats['p99_ms']:8.2f} ms")
+        return results
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+# --- Results ---
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    try:
+        import torch
+        torch_version = torch.__version__
+    except ImportError:
+        torch_version = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": rev, "python": platform.python_version(),
+            "torch": torch_version, "cpu_count": os.cpu_count(), "machine": platform.machine()}
+
+
+def latest_run():
+    runs = sorted(glob.glob(os.path.join(RESULTS_DIR, "bench_*.json")))
+    if not runs:
+        raise FileNotFoundError(f"No bench_*.json in {RESULTS_DIR}/")
+    return runs[-1]
+
+
+def compare(baseline_path, current_path, threshold):
+    """Print per-benchmark latency change; returns the list of regressions."""
+    with open(baseline_path) as f:
+        base = json.load(f)["results"]
+    with open(current_path) as f:
+        cur = json.load(f)["results"]
+    regressions = []
+    for name in sorted(set(base) & set(cur)):
+        before, after = base[name]["latency_ms"], cur[name]["latency_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  improved"
+        print(f"{name:45s} {before:9.3f} → {after:9.3f} ms ({change*100:+6.1f}%){flag}")
+    for name in sorted(set(base) - set(cur)):
+        print(f"{name:45s} missing from current run")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run")
+    p_run.add_argument("--suites", nargs="+", default=["model", "ecc", "http"],
+                       choices=["model", "ecc", "registry", "http"])
+    p_run.add_argument("--resolutions", type=int, nargs="+", default=[256, 512, 1024])
+    p_run.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    p_run.add_argument("--threads", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    p_run.add_argument("--ecc-counts", type=int, nargs="+", default=[1, 100, 10000])
+    p_run.add_argument("--registry-sizes", type=int, nargs="+", default=[1000000])
+    p_run.add_argument("--registry-queries", type=int, default=1000)
+    p_run.add_argument("--registry-flips", type=int, nargs="+", default=[0, 4, 8])
+    p_run.add_argument("--repeats", type=int, default=10)
+    p_run.add_argument("--http-requests", type=int, default=30)
+    p_run.add_argument("--save-baseline", action="store_true")
+    p_cmp = sub.add_parser("compare")
+    p_cmp.add_argument("current", nargs="?", help="run to check (default: latest results/bench_*.json)")
+    p_cmp.add_argument("--baseline", default=BASELINE)
+    p_cmp.add_argument("--threshold", type=float, default=0.10, help="relative latency increase that fails")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "compare":
+        regressions = compare(args.baseline, args.current or latest_run(), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold*100:.0f}%")
+            raise SystemExit(1)
+        return
+
+    results = {}
+    if "model" in args.suites:
+        results.update(bench_models(args.resolutions, args.batch_sizes, args.threads, args.repeats))
+    if "ecc" in args.suites:
+        results.update(bench_ecc(args.ecc_counts, args.repeats))
+    if "registry" in args.suites:
+        results.update(bench_registry(args.registry_sizes, args.registry_queries, args.registry_flips))
+    if "http" in args.suites:
+        results.update(bench_http(args.resolutions, args.http_requests))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"bench_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"Wrote {path}")
+    if args.save_baseline:
+        shutil.copyfile(path, BASELINE)
+        print(f"Saved baseline {BASELINE}")
+
+
+if __name__ == "__main__":
+    main()
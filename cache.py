@@ -0,0 +1,126 @@
+# cache.py
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Content-addressed result cache: a bounded in-memory LRU in front of a bounded on-disk LRU.
+
+    Values are (bytes, info) where info is a small JSON-serialisable dict.
+    New entries are written to both tiers; a disk hit is promoted to memory.
+    Each tier evicts least-recently-used entries until it is under its byte
+    budget (a budget of 0 disables that tier).
+    """
+
+    def __init__(self, memory_bytes=256 * 2**20, disk_dir=None, disk_bytes=0):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir if disk_bytes else None
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._mem = OrderedDict()   # key -> (data, info)
+        self._mem_size = 0
+        self._disk = OrderedDict()  # key -> size on disk, oldest first
+        self._disk_size = 0
+        self.stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0,
+                      "evictions_memory": 0, "evictions_disk": 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    # --- Disk tier ---
+    def _paths(self, key):
+        base = os.path.join(self.disk_dir, key)
+        return base + ".bin", base + ".json"
+
+    def _load_disk_index(self):
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".bin"):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _disk_get(self, key):
+        data_path, info_path = self._paths(key)
+        try:
+            with open(data_path, "rb") as f:
+                data = f.read()
+            with open(info_path) as f:
+                info = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._disk_drop(key)
+            return None
+        os.utime(data_path)  # mtime is the LRU order across restarts
+        self._disk.move_to_end(key)
+        return data, info
+
+    def _disk_put(self, key, data, info):
+        data_path, info_path = self._paths(key)
+        with open(data_path + ".tmp", "wb") as f:
+            f.write(data)
+        with open(info_path, "w") as f:
+            json.dump(info, f)
+        os.replace(data_path + ".tmp", data_path)
+        self._disk_drop(key)
+        self._disk[key] = len(data)
+        self._disk_size += len(data)
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            old_key = next(iter(self._disk))
+            self._disk_drop(old_key, remove=True)
+            self.stats["evictions_disk"] += 1
+
+    def _disk_drop(self, key, remove=False):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_size -= size
+        if remove:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # --- Public API ---
+    def get(self, key):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.stats["hits_memory"] += 1
+                return self._mem[key]
+            if self.disk_dir and key in self._disk:
+                hit = self._disk_get(key)
+                if hit is not None:
+                    self.stats["hits_disk"] += 1
+                    self._mem_put(key, *hit)
+                    return hit
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, data, info):
+        with self._lock:
+            self._mem_put(key, data, info)
+            if self.disk_dir:
+                self._disk_put(key, data, info)
+
+    def _mem_put(self, key, data, info):
+        if not self.memory_bytes or len(data) > self.memory_bytes:
+            return
+        if key in self._mem:
+            self._mem_size -= len(self._mem.pop(key)[0])
+        self._mem[key] = (data, info)
+        self._mem_size += len(data)
+        while self._mem_size > self.memory_bytes:
+            _, (old, _) = self._mem.popitem(last=False)
+            self._mem_size -= len(old)
+            self.stats["evictions_memory"] += 1
+
+    def snapshot(self):
+        """Counters plus current tier sizes."""
+        with self._lock:
+            return dict(self.stats,
+                        memory_entries=len(self._mem), memory_bytes=self._mem_size,
+                        disk_entries=len(self._disk), disk_bytes=self._disk_size)
@@ -1,4 +1,5 @@
 import os
+import json
 import random
 import string
 import base64
@@ -6,10 +7,150 @@ from torch.utils.data import Dataset
 from PIL import Image
 import torchvision.transforms as transforms
 import torch
+import numpy as np
 import datetime
 
+from ecc import fit_bits
+
+
+# --- Preprocessed image cache ---
+def _file_stamp(path):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def build_image_cache(image_files, target_size, cache_dir):
+    """Resize every image once into a uint8 (N,H,W,3) memory-mapped file.
+
+    The index next to it records each source file's size and mtime; rows whose
+    source is unchanged are copied from the previous cache, the rest are decoded
+    again. Returns (data_path, index).
+    """
+    if not image_files:
+        raise ValueError("No images to cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    h, w = target_size
+    stem = os.path.join(cache_dir, f"images_{h}x{w}")
+    data_path, index_path = stem + ".u8", stem + ".json"
+    stamps = [_file_stamp(p) for p in image_files]
+
+    old = None
+    if os.path.exists(index_path) and os.path.exists(data_path):
+        with open(index_path) as f:
+            old = json.load(f)
+        if old["entries"] == stamps:
+            return data_path, old
+
+    reuse, old_data = {}, None
+    if old is not None:
+        reuse = {(e["path"], e["size"], e["mtime_ns"]): i for i, e in enumerate(old["entries"])}
+        old_data = np.memmap(data_path, dtype=np.uint8, mode="r", shape=tuple(old["shape"]))
+
+    tmp_path = data_path + ".tmp"
+    data = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=(len(stamps), h, w, 3))
+    for i, (path, stamp) in enumerate(zip(image_files, stamps)):
+        row = reuse.get((stamp["path"], stamp["size"], stamp["mtime_ns"]))
+        if row is not None:
+            data[i] = old_data[row]
+        else:
+            image = Image.open(path).convert("RGB").resize((w, h), Image.BILINEAR)
+            data[i] = np.asarray(image)
+    data.flush()
+    del data, old_data
+    os.replace(tmp_path, data_path)
+
+    index = {"shape": [len(stamps), h, w, 3], "entries": stamps}
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+    return data_path, index
+
+
+def images_to_float(imgs):
+    """Normalize a batch from the uint8 cache to float 0..1; float batches pass through."""
+    if imgs.dtype == torch.uint8:
+        return imgs.float().div_(255.0)
+    return imgs.float()
+
+
+# --- Payload bank ---
+USERNAME_ALPHABET = np.frombuffer((string.ascii_lowercase + string.digits).encode(), dtype=np.uint8)
+B64_ALPHABET = np.frombuffer(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/", dtype=np.uint8)
+
+
+def _b64encode_rows(rows):
+    """Base64-encode each row of an (N, k) uint8 array; returns (N, 4*ceil(k/3)) ASCII codes."""
+    n, k = rows.shape
+    pad = -k % 3
+    padded = np.concatenate([rows, np.zeros((n, pad), dtype=np.uint8)], axis=1)
+    triples = padded.reshape(n, -1, 3).astype(np.uint32)
+    triples = (triples[..., 0] << 16) | (triples[..., 1] << 8) | triples[..., 2]
+    idx = np.stack([(triples >> shift) & 63 for shift in (18, 12, 6, 0)], axis=-1).reshape(n, -1)
+    out = B64_ALPHABET[idx]
+    if pad:
+        out[:, -pad:] = ord("=")
+    return out
+
+
+def generate_payload_bits(n, payload_size=1024, rng=None, username_length=6):
+    """Vectorized encode_metadata() + metadata_to_tensor() for n samples.
+
+    Builds n random 'username|YYYY-MM-DD HH:MM:SS' strings (timestamps spread
+    over the past year), base64-encodes them and returns (n, payload_size) uint8 bits.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    names = USERNAME_ALPHABET[rng.integers(len(USERNAME_ALPHABET), size=(n, username_length))]
+    now = np.datetime64(datetime.datetime.now().replace(microsecond=0), "s")
+    stamps = now - rng.integers(0, 365 * 24 * 3600, size=n).astype("timedelta64[s]")
+    ts = np.char.replace(np.datetime_as_string(stamps, unit="s"), "T", " ").astype("S19")
+    ts = ts.view(np.uint8).reshape(n, 19)
+    sep = np.full((n, 1), ord("|"), dtype=np.uint8)
+    meta = np.concatenate([names, sep, ts], axis=1)
+    return fit_bits(np.unpackbits(_b64encode_rows(meta), axis=1), payload_size)
+
+
+def make_payload_bank(size, payload_size=1024, seed=0):
+    """Generate a reproducible pool of payloads, packed 8 bits per byte: (size, payload_size/8)."""
+    bits = generate_payload_bits(size, payload_size, np.random.default_rng(seed))
+    return np.packbits(bits, axis=1)
+
+
+class PayloadCollate:
+    """Batch collate that stacks images and expands payloads to float once per batch.
+
+    Packed uint8 payloads (bank mode) are unpacked here; empty payloads
+    (generate mode) are replaced by a freshly generated batch; float payloads
+    from the legacy per-sample path are stacked as-is.
+    """
+
+    def __init__(self, payload_size=1024, seed=None):
+        self.payload_size = payload_size
+        self.seed = seed
+        self._rng = None
+
+    def _generator(self):
+        if self._rng is None:
+            # torch.initial_seed() differs per DataLoader worker.
+            worker_seed = torch.initial_seed() % 2**32
+            self._rng = np.random.default_rng(worker_seed if self.seed is None else [self.seed, worker_seed])
+        return self._rng
+
+    def __call__(self, samples):
+        images = torch.stack([s[0] for s in samples])
+        payloads = [s[1] for s in samples]
+        if payloads[0].numel() == 0:
+            bits = generate_payload_bits(len(samples), self.payload_size, self._generator())
+        elif payloads[0].dtype == torch.uint8:
+            bits = np.unpackbits(torch.stack(payloads).numpy(), axis=1, count=self.payload_size)
+        else:
+            return images, torch.stack(payloads)
+        return images, torch.from_numpy(bits).float()
+
+
 class ImageDataset(Dataset):
-    def __init__(self, root_dir, target_size=(256, 256), payload_size=1024):
+    def __init__(self, root_dir, target_size=(256, 256), payload_size=1024, cache_dir=None,
+                 payload_bank=None, generate_payloads=False):
         self.root_dir = root_dir
         self.image_files = [
             os.path.join(root_dir, f)
@@ -23,6 +164,29 @@ class ImageDataset(Dataset):
             transforms.ToTensor()
         ])
 
+        # payload_bank: packed rows from make_payload_bank(); generate_payloads: leave
+        # payload creation to PayloadCollate. Both need PayloadCollate as collate_fn.
+        self.payload_bank = payload_bank
+        self.generate_payloads = generate_payloads
+
+        # With a cache_dir, images are served as uint8 (3,H,W) views into a shared
+        # memmap instead of being decoded every epoch; see images_to_float().
+        self.cache_path = None
+        self._cache = None
+        if cache_dir is not None:
+            self.cache_path, index = build_image_cache(self.image_files, self.target_size, cache_dir)
+            self._cache_shape = tuple(index["shape"])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_cache"] = None  # each DataLoader worker maps the file itself
+        return state
+
+    def cached_image(self, idx):
+        if self._cache is None:
+            self._cache = np.memmap(self.cache_path, dtype=np.uint8, mode="c", shape=self._cache_shape)
+        return torch.from_numpy(self._cache[idx]).permute(2, 0, 1)
+
     def __len__(self):
         return len(self.image_files)
 
@@ -45,12 +209,20 @@ class ImageDataset(Dataset):
         return torch.FloatTensor(bits)
 
     def __getitem__(self, idx):
-        img_path = self.image_files[idx]
-        image = Image.open(img_path).convert("RGB")
-        if self.transform:
-            image = self.transform(image)
+        if self.cache_path is not None:
+            image = self.cached_image(idx)
+        else:
+            img_path = self.image_files[idx]
+            image = Image.open(img_path).convert("RGB")
+            if self.transform:
+                image = self.transform(image)
 
-        encoded_meta = self.encode_metadata()
-        payload = self.metadata_to_tensor(encoded_meta)
+        if self.payload_bank is not None:
+            payload = torch.from_numpy(self.payload_bank[random.randrange(len(self.payload_bank))])
+        elif self.generate_payloads:
+            payload = torch.empty(0, dtype=torch.uint8)
+        else:
+            encoded_meta = self.encode_metadata()
+            payload = self.metadata_to_tensor(encoded_meta)
 
         return image, payload
@@ -0,0 +1,169 @@
+"""Distill lighter decoder variants from checkpoints/decoder.pth and register them.
+
+    python distill_decoder.py                          # every preset
+    python distill_decoder.py --variants lite-s2 --prune 0.5
+    DECODER_BACKEND=lite-s2 python app.py              # serve a registered variant
+
+Each student (a LiteDecoderCNN) learns to reproduce the teacher's bit
+probabilities on freshly watermarked training images, with a --alpha share of
+the loss on the true payload bits. --prune then drops that fraction of every
+conv's output channels (smallest L1 filter norm first). The layers are
+physically smaller, not masked. The pruned student is fine-tuned the same way.
+Every variant is measured on datasets/val (latency, size, bit accuracy) and
+recorded in checkpoints/decoder_variants.json.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from backends import load_weights, register_variant
+from dataset import generate_payload_bits, images_to_float
+from export_decoder import evaluate, load_val_images
+from model import DecoderCNN, EncoderCNN, LiteDecoderCNN
+from train import CACHE_DIR, CHECKPOINTS, atomic_save, build_loader
+
+PAYLOAD_SIZE = 1024
+VAL_DIR = os.path.join("datasets", "val")
+
+# name → LiteDecoderCNN arguments
+PRESETS = {
+    "lite-s2": dict(channels=(32, 32, 16), strides=(2, 2, 1), pool=16, rank=256),  # strided, low-rank head
+    "lite-s4": dict(channels=(32, 32, 16), strides=(2, 2, 2), pool=8, rank=256),
+    "narrow": dict(channels=(32, 32, 16), strides=(1, 1, 1), pool=32, rank=0),     # fewer channels only
+    "factor": dict(channels=(64, 64, 32), strides=(1, 1, 1), pool=32, rank=128),   # full convs, factorized head
+}
+
+
+# --- Pruning ---
+def prune_channels(model, amount):
+    """New LiteDecoderCNN keeping the (1 - amount) output channels of each conv with the largest L1 norm."""
+    config = dict(model.config)
+    convs = [model.conv1, model.conv2, model.conv3]
+    keep = []
+    for conv in convs:
+        n = max(1, round(conv.out_channels * (1 - amount)))
+        norms = conv.weight.detach().abs().sum(dim=(1, 2, 3))
+        keep.append(torch.sort(torch.topk(norms, n).indices).values)
+    config["channels"] = [len(k) for k in keep]
+    pruned = LiteDecoderCNN(**config)
+    with torch.no_grad():
+        prev = torch.arange(3)
+        for conv, new, k in zip(convs, [pruned.conv1, pruned.conv2, pruned.conv3], keep):
+            new.weight.copy_(conv.weight[k][:, prev])
+            new.bias.copy_(conv.bias[k])
+            prev = k
+        # fc inputs are flattened channel-major: keep the pool x pool block of every kept channel.
+        area = config["pool"] ** 2
+        fc_w = model.fc.weight.view(model.fc.out_features, -1, area)[:, keep[-1]]
+        pruned.fc.weight.copy_(fc_w.reshape(model.fc.out_features, -1))
+        pruned.fc.bias.copy_(model.fc.bias)
+        pruned.head.load_state_dict(model.head.state_dict())
+    return pruned
+
+
+# --- Distillation ---
+def distill(student, teacher, encoder, loader, steps, lr, alpha, log_every=50):
+    """Train student on BCE against the teacher's probabilities (and alpha x BCE against the payload)."""
+    bce = nn.BCELoss()
+    optimizer = optim.Adam(student.parameters(), lr=lr)
+    student.train()
+    step = epoch = 0
+    while step < steps:
+        loader.sampler.set_epoch(epoch)
+        epoch += 1
+        for imgs, payloads in loader:
+            imgs = images_to_float(imgs)
+            payloads = payloads.float()
+            with torch.no_grad():
+                watermarked = encoder(imgs, payloads)
+                target = teacher(watermarked)
+            pred = student(watermarked)
+            loss = (1 - alpha) * bce(pred, target) + alpha * bce(pred, payloads)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            step += 1
+            if step % log_every == 0:
+                agree = ((pred > 0.5) == (target > 0.5)).float().mean().item()
+                print(f"  [step {step}/{steps}] loss={loss.item():.4f} teacher agreement={agree*100:.2f}%")
+            if step >= steps:
+                break
+    return student.eval()
+
+
+def measure(name, decoder, watermarked, payloads, checkpoints):
+    """Save the variant, measure it on the validation set and register it."""
+    path = f"decoder_{name}.pth"
+    atomic_save(decoder.state_dict(), os.path.join(checkpoints, path))
+    stats = evaluate(decoder, watermarked, payloads)
+    entry = dict(stats, arch=decoder.config, path=path,
+                 params=sum(p.numel() for p in decoder.parameters()),
+                 size_mb=os.path.getsize(os.path.join(checkpoints, path)) / 2**20,
+                 created=time.time())
+    register_variant(name, entry, checkpoints)
+    return entry
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variants", nargs="+", default=sorted(PRESETS), choices=sorted(PRESETS))
+    parser.add_argument("--data", default="datasets/train")
+    parser.add_argument("--val", default=VAL_DIR)
+    parser.add_argument("--checkpoints", default=CHECKPOINTS)
+    parser.add_argument("--steps", type=int, default=2000, help="distillation steps per variant")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--alpha", type=float, default=0.2, help="weight of the true-payload loss")
+    parser.add_argument("--prune", type=float, default=0.0, help="fraction of conv channels to remove")
+    parser.add_argument("--finetune-steps", type=int, default=500, help="distillation steps after pruning")
+    parser.add_argument("--size", type=int, default=256, help="validation images are resized to size x size")
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(args.seed)
+    # encoder.pth restores the residual scale it was trained with.
+    encoder = load_weights(EncoderCNN(), os.path.join(args.checkpoints, "encoder.pth")).eval()
+    teacher = load_weights(DecoderCNN(payload_size=PAYLOAD_SIZE), os.path.join(args.checkpoints, "decoder.pth")).eval()
+    for p in list(encoder.parameters()) + list(teacher.parameters()):
+        p.requires_grad_(False)
+    loader = build_loader(args.data, batch_size=args.batch_size, num_workers=args.workers, cache_dir=CACHE_DIR)
+
+    images = load_val_images(args.val, args.size)
+    bits = generate_payload_bits(len(images), PAYLOAD_SIZE, np.random.default_rng(args.seed))
+    payloads = [torch.from_numpy(row).float().unsqueeze(0) for row in bits]
+    with torch.no_grad():
+        watermarked = [encoder(img, p) for img, p in zip(images, payloads)]
+    base = evaluate(teacher, watermarked, payloads)
+    print(f"{'teacher':14s} acc={base['bit_accuracy']*100:6.2f}% latency={base['latency_ms']:7.2f}ms")
+
+    def report(name, entry):
+        print(f"{name:14s} acc={entry['bit_accuracy']*100:6.2f}% "
+              f"(Δ {(entry['bit_accuracy'] - base['bit_accuracy'])*100:+.2f}) "
+              f"latency={entry['latency_ms']:7.2f}ms x{base['latency_ms'] / max(entry['latency_ms'], 1e-9):.2f} "
+              f"size={entry['size_mb']:.2f}MB")
+
+    for name in args.variants:
+        print(f"Distilling {name} {PRESETS[name]}")
+        student = LiteDecoderCNN(payload_size=PAYLOAD_SIZE, **PRESETS[name])
+        student = distill(student, teacher, encoder, loader, args.steps, args.lr, args.alpha)
+        report(name, measure(name, student, watermarked, payloads, args.checkpoints))
+        if args.prune:
+            pruned_name = f"{name}-p{round(args.prune * 100)}"
+            print(f"Pruning {args.prune:.0%} of the conv channels → {pruned_name}")
+            student = prune_channels(student, args.prune)
+            student = distill(student, teacher, encoder, loader, args.finetune_steps, args.lr / 10, args.alpha)
+            report(pruned_name, measure(pruned_name, student, watermarked, payloads, args.checkpoints))
+    print(f"Registered in {os.path.join(args.checkpoints, 'decoder_variants.json')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# ecc.py
+"""Batched payload codec shared by app.py, embedding.py and Decoder.py.
+
+Payloads are (N, payload_size) arrays of 0/1 bits. Metadata is framed as its
+UTF-8 bytes, MSB first, optionally Hamming(7,4)-coded, then zero-padded or
+truncated to ``payload_size``. Each 7-bit codeword is laid out as
+[p1, p2, d0, p3, d1, d2, d3], so a non-zero syndrome is the 1-based position
+of a single flipped bit.
+"""
+import numpy as np
+
+# Generator matrix: 4 data bits -> 7-bit codeword.
+G = np.array([
+    [1, 1, 1, 0, 0, 0, 0],
+    [1, 0, 0, 1, 1, 0, 0],
+    [0, 1, 0, 1, 0, 1, 0],
+    [1, 1, 0, 1, 0, 0, 1],
+], dtype=np.uint8)
+
+# Parity-check matrix (7 x 3): codeword @ H % 2 gives syndrome bits (c1, c2, c3).
+H = np.array([
+    [1, 0, 0],
+    [0, 1, 0],
+    [1, 1, 0],
+    [0, 0, 1],
+    [1, 0, 1],
+    [0, 1, 1],
+    [1, 1, 1],
+], dtype=np.uint8)
+
+DATA_POSITIONS = [2, 4, 5, 6]
+_SYNDROME_WEIGHTS = np.array([1, 2, 4], dtype=np.uint8)
+
+# Syndrome (0..7) -> bit mask that flips the erroneous position.
+CORRECTION_TABLE = np.zeros((8, 7), dtype=np.uint8)
+for _pos in range(1, 8):
+    CORRECTION_TABLE[_pos, _pos - 1] = 1
+
+
+# --- Bit packing ---
+def bytes_to_bits(items):
+    """Unpack a list of bytes/str into a zero-padded (N, 8*max_len) uint8 bit array."""
+    raw = [i.encode("utf-8") if isinstance(i, str) else bytes(i) for i in items]
+    width = max((len(r) for r in raw), default=0)
+    buf = np.zeros((len(raw), width), dtype=np.uint8)
+    for row, r in enumerate(raw):
+        buf[row, :len(r)] = np.frombuffer(r, dtype=np.uint8)
+    return np.unpackbits(buf, axis=1)
+
+
+def bits_to_strings(bits):
+    """Pack (N, k) bits into bytes and decode each row as UTF-8 text."""
+    bits = np.asarray(bits, dtype=np.uint8)
+    usable = bits.shape[1] - bits.shape[1] % 8
+    packed = np.packbits(bits[:, :usable], axis=1)
+    return [row.tobytes().rstrip(b"\x00").decode("utf-8", errors="ignore") for row in packed]
+
+
+def fit_bits(bits, payload_size):
+    """Zero-pad or truncate (N, k) bits to (N, payload_size)."""
+    n, k = bits.shape
+    if k >= payload_size:
+        return np.ascontiguousarray(bits[:, :payload_size])
+    out = np.zeros((n, payload_size), dtype=np.uint8)
+    out[:, :k] = bits
+    return out
+
+
+def to_bits(values, threshold=0.5):
+    """Threshold decoder probabilities (tensor or array) into uint8 bits."""
+    if hasattr(values, "detach"):
+        values = values.detach().cpu().numpy()
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values[None, :]
+    return (values > threshold).astype(np.uint8)
+
+
+# --- Hamming(7,4) ---
+def hamming_encode_bits(bits):
+    """(N, 4k) data bits -> (N, 7k) codewords. Rows are zero-padded to a multiple of 4."""
+    n, k = bits.shape
+    if k % 4:
+        bits = fit_bits(bits, k + 4 - k % 4)
+    blocks = bits.reshape(n, -1, 4).astype(np.uint8)
+    return ((blocks @ G) % 2).astype(np.uint8).reshape(n, -1)
+
+
+def hamming_syndromes(bits):
+    """(N, 7k) codewords -> (N, k) syndromes; 0 means the block checks clean."""
+    n, k = bits.shape
+    blocks = bits[:, :k - k % 7].reshape(n, -1, 7).astype(np.uint8)
+    return (((blocks @ H) % 2) @ _SYNDROME_WEIGHTS).astype(np.uint8)
+
+
+def syndromes_clean(bits, threshold=0.5):
+    """(N) bool: True where every Hamming block of a row checks clean."""
+    return ~hamming_syndromes(to_bits(bits, threshold)).any(axis=1)
+
+
+def hamming_decode_bits(bits, return_syndromes=False):
+    """(N, 7k) codewords -> (N, 4k) data bits, correcting one flipped bit per block."""
+    n, k = bits.shape
+    blocks = bits[:, :k - k % 7].reshape(n, -1, 7).astype(np.uint8)
+    syndromes = hamming_syndromes(bits)
+    corrected = blocks ^ CORRECTION_TABLE[syndromes]
+    data = corrected[..., DATA_POSITIONS].reshape(n, -1)
+    if return_syndromes:
+        return data, syndromes
+    return data
+
+
+# --- Framing ---
+def encode_payloads(items, payload_size=1024, ecc=True):
+    """Encode a list of str/bytes metadata into an (N, payload_size) uint8 bit array."""
+    bits = bytes_to_bits(items)
+    if ecc:
+        bits = hamming_encode_bits(bits)
+    return fit_bits(bits, payload_size)
+
+
+def decode_payloads(bits, ecc=True, threshold=0.5):
+    """Decode (N, payload_size) bits or probabilities back into N metadata strings."""
+    bits = to_bits(bits, threshold)
+    if ecc:
+        bits = hamming_decode_bits(bits)
+    return bits_to_strings(bits)
@@ -0,0 +1,323 @@
+"""Robustness evaluation of the checkpoints on datasets/val.
+
+Each validation image is watermarked with a payload built the way the
+service builds one: a 'username|YYYY-MM-DD HH:MM:SS' string, Hamming(7,4)-coded
+as with PAYLOAD_ECC=1 (or plain with --no-ecc) and zero-padded. Every image is
+put through every attack and decoded in batches. Per attack the run reports
+raw bit accuracy over the payload, metadata bit accuracy after decoding, the
+fraction of metadata strings recovered exactly, and the PSNR of the attacked
+image against the cover.
+
+    python evaluate.py                                   # default attack set
+    python evaluate.py --attacks none jpeg:75 crop:0.5 --workers 8
+    python evaluate.py --resume results/eval_<id>        # continue an interrupted run
+
+Images are handed out in chunks to a spawn-based process pool, so the run uses
+every core. Per-image rows are appended to <run>/rows.jsonl as chunks finish;
+rerunning the same command skips images that are already there.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import multiprocessing as mp
+import os
+import string
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+import torch
+
+import ecc
+from backends import load_decoder_backend, load_weights
+from model import EncoderCNN
+
+CHECKPOINTS = "checkpoints"
+VAL_DIR = os.path.join("datasets", "val")
+RESULTS_DIR = "results"
+PAYLOAD_SIZE = 1024
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+USERNAME_CHARS = string.ascii_lowercase + string.digits
+METADATA_EPOCH = datetime.datetime(2026, 1, 1)  # fixed, so payloads do not depend on when the run starts
+DEFAULT_ATTACKS = ["none", "jpeg:90", "jpeg:75", "jpeg:50", "resize:0.5", "crop:0.75",
+                   "blur:3", "noise:0.02"]
+
+
+# --- Attacks ---
+# Each attack maps (watermarked, cover) uint8 RGB to (attacked, reference); the
+# reference is the cover put through the same geometric change, for PSNR.
+def attack_none(img, cover, _param, _rng):
+    return img, cover
+
+
+def attack_jpeg(img, cover, quality, _rng):
+    buf = cv2.imencode(".jpg", cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, int(quality)])[1]
+    return cv2.cvtColor(cv2.imdecode(buf, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB), cover
+
+
+def attack_resize(img, cover, scale, _rng):
+    h, w = img.shape[:2]
+    small = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR), cover
+
+
+def attack_crop(img, cover, keep, _rng):
+    h, w = img.shape[:2]
+    ch, cw = max(1, round(h * keep)), max(1, round(w * keep))
+    y, x = (h - ch) // 2, (w - cw) // 2
+    return img[y:y + ch, x:x + cw], cover[y:y + ch, x:x + cw]
+
+
+def attack_blur(img, cover, ksize, _rng):
+    k = int(ksize) | 1
+    return cv2.GaussianBlur(img, (k, k), 0), cover
+
+
+def attack_noise(img, cover, sigma, rng):
+    noisy = img.astype(np.float32) + rng.normal(0.0, sigma * 255.0, img.shape)
+    return noisy.clip(0, 255).astype(np.uint8), cover
+
+
+ATTACKS = {
+    "none": attack_none,
+    "jpeg": attack_jpeg,
+    "resize": attack_resize,
+    "crop": attack_crop,
+    "blur": attack_blur,
+    "noise": attack_noise,
+}
+
+
+def parse_attack(spec):
+    """'jpeg:75' → (attack function, 75.0)."""
+    name, _, param = spec.partition(":")
+    if name not in ATTACKS:
+        raise ValueError(f"Unknown attack {name!r}; choose from {sorted(ATTACKS)}")
+    return ATTACKS[name], float(param) if param else None
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+# --- Payloads ---
+def image_key(name):
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def image_metadata(seed, name):
+    """Reproducible 'username|timestamp' for one image, independent of chunking or resume."""
+    rng = np.random.default_rng([seed, image_key(name)])
+    username = "".join(rng.choice(list(USERNAME_CHARS), size=int(rng.integers(4, 13))))
+    stamp = METADATA_EPOCH - datetime.timedelta(seconds=int(rng.integers(365 * 24 * 3600)))
+    return f"{username}|{stamp:%Y-%m-%d %H:%M:%S}"
+
+
+# --- Worker process ---
+_worker = {}
+
+
+def _init_worker(checkpoints, backend, num_threads):
+    torch.set_num_threads(num_threads)
+    _worker["encoder"] = load_weights(EncoderCNN(), os.path.join(checkpoints, "encoder.pth")).eval()
+    _worker["decoder"] = load_decoder_backend(backend, checkpoints, PAYLOAD_SIZE)
+
+
+def load_image(path, size):
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Failed to read {path}")
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    if size:
+        img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def to_tensor(images):
+    return torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).float().div_(255.0)
+
+
+def evaluate_chunk(items, attacks, size, seed, use_ecc=True):
+    """Evaluate image paths under every attack; returns one row per (image, attack)."""
+    encoder, decoder = _worker["encoder"], _worker["decoder"]
+    covers, metas, names = [], [], []
+    for path in items:
+        try:
+            covers.append(load_image(path, size))
+        except ValueError:
+            continue
+        name = os.path.basename(path)
+        metas.append(image_metadata(seed, name))
+        names.append(name)
+    if not covers:
+        return []
+    coded = ecc.encode_payloads(metas, PAYLOAD_SIZE, ecc=use_ecc)
+    data = ecc.bytes_to_bits(metas)
+    lengths = [8 * len(m.encode("utf-8")) for m in metas]
+
+    with torch.no_grad():
+        wm = encoder(to_tensor(covers), torch.from_numpy(coded).float())
+    wm = (wm.permute(0, 2, 3, 1).numpy() * 255.0).round().clip(0, 255).astype(np.uint8)
+
+    rows = []
+    for a_idx, spec in enumerate(attacks):
+        fn, param = parse_attack(spec)
+        attacked, refs = [], []
+        for i, (img, cover) in enumerate(zip(wm, covers)):
+            rng = np.random.default_rng([seed, image_key(names[i]), a_idx])
+            a, r = fn(img, cover, param, rng)
+            attacked.append(a)
+            refs.append(r)
+        # One decoder forward per attack (all images share a shape after the attack).
+        with torch.no_grad():
+            pred = decoder(to_tensor(attacked))
+        bits = ecc.to_bits(pred)
+        decoded = ecc.hamming_decode_bits(bits) if use_ecc else bits
+        texts = ecc.bits_to_strings(decoded)
+        for i, name in enumerate(names):
+            n = lengths[i]
+            rows.append({
+                "image": name,
+                "attack": spec,
+                "bit_accuracy": float((bits[i] == coded[i]).mean()),
+                "ecc_accuracy": float((decoded[i, :n] == data[i, :n]).mean()),
+                "recovered": texts[i] == metas[i],
+                "psnr": psnr(attacked[i], refs[i]),
+            })
+    return rows
+
+
+# --- Run bookkeeping ---
+def run_id(args):
+    stamp = [os.path.abspath(args.val), args.size, args.seed, args.backend, sorted(args.attacks), "metadata",
+             args.ecc]
+    for name in ("encoder.pth", "decoder.pth"):
+        path = os.path.join(args.checkpoints, name)
+        stamp.append(os.stat(path).st_mtime_ns if os.path.exists(path) else None)
+    return hashlib.blake2b(json.dumps(stamp).encode(), digest_size=6).hexdigest()
+
+
+def read_rows(rows_path):
+    """{(image, attack): row}; later rows win, so re-evaluated images are not double counted."""
+    rows = {}
+    if os.path.exists(rows_path):
+        with open(rows_path) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # partial line from an interrupted write
+                rows[row["image"], row["attack"]] = row
+    return rows
+
+
+def completed_images(rows_path, attacks):
+    """Image names that already have a row for every attack."""
+    seen = {}
+    for image, attack in read_rows(rows_path):
+        seen.setdefault(image, set()).add(attack)
+    return {name for name, done in seen.items() if done >= set(attacks)}
+
+
+def summarize(rows_path, attacks):
+    by_attack = {spec: [] for spec in attacks}
+    for (_, attack), row in read_rows(rows_path).items():
+        if attack in by_attack:
+            by_attack[attack].append(row)
+    summary = {}
+    for spec, rows in by_attack.items():
+        if not rows:
+            continue
+        finite = [r["psnr"] for r in rows if math.isfinite(r["psnr"])]
+        summary[spec] = {
+            "images": len(rows),
+            "bit_accuracy": float(np.mean([r["bit_accuracy"] for r in rows])),
+            "ecc_accuracy": float(np.mean([r["ecc_accuracy"] for r in rows])),
+            "recovered": float(np.mean([r["recovered"] for r in rows])),
+            "psnr": float(np.mean(finite)) if finite else None,
+        }
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--val", default=VAL_DIR)
+    parser.add_argument("--checkpoints", default=CHECKPOINTS)
+    parser.add_argument("--backend", default="float", help="decoder backend (see backends.py)")
+    parser.add_argument("--attacks", nargs="+", default=DEFAULT_ATTACKS, help="name[:param] specs")
+    parser.add_argument("--size", type=int, default=256, help="resize images to size x size (0 = native)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per worker")
+    parser.add_argument("--chunk", type=int, default=16, help="images per task")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-ecc", dest="ecc", action="store_false",
+                        help="embed plain metadata, as the service does with PAYLOAD_ECC=0")
+    parser.add_argument("--resume", default=None, help="run directory to continue (default: derived from config)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for spec in args.attacks:
+        parse_attack(spec)  # fail fast on typos
+    if not args.size and args.chunk > 1:
+        print("Native-size images differ in shape: using --chunk 1")
+        args.chunk = 1
+
+    files = sorted(os.path.join(args.val, n) for n in os.listdir(args.val) if n.lower().endswith(IMAGE_EXTENSIONS))
+    if not files:
+        raise FileNotFoundError(f"No validation images in {args.val}")
+
+    run_dir = args.resume or os.path.join(RESULTS_DIR, f"eval_{run_id(args)}")
+    os.makedirs(run_dir, exist_ok=True)
+    rows_path = os.path.join(run_dir, "rows.jsonl")
+    done = completed_images(rows_path, args.attacks)
+    todo = [p for p in files if os.path.basename(p) not in done]
+    chunks = [todo[i:i + args.chunk] for i in range(0, len(todo), args.chunk)]
+    print(f"{len(files)} images, {len(done)} already evaluated, {len(chunks)} chunks → {run_dir}")
+
+    t0 = time.perf_counter()
+    finished = 0
+    if chunks:
+        pool = ProcessPoolExecutor(args.workers, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                                   initargs=(args.checkpoints, args.backend, args.threads))
+        with pool, open(rows_path, "a") as out:
+            pending = iter(chunks)
+            inflight = set()
+            while True:
+                # Keep a bounded number of chunks queued so images stream through.
+                for chunk in pending:
+                    inflight.add(pool.submit(evaluate_chunk, chunk, args.attacks, args.size, args.seed, args.ecc))
+                    if len(inflight) >= args.workers * 2:
+                        break
+                if not inflight:
+                    break
+                done_now, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done_now:
+                    rows = fut.result()
+                    out.write("".join(json.dumps(r) + "\n" for r in rows))
+                    out.flush()
+                    finished += len({r["image"] for r in rows})
+                    rate = finished / (time.perf_counter() - t0)
+                    print(f"\r{finished}/{len(todo)} images ({rate:.1f} img/s)", end="", flush=True)
+        print()
+
+    summary = summarize(rows_path, args.attacks)
+    report = {"config": {k: v for k, v in vars(args).items() if k != "resume"}, "images": len(files),
+              "seconds": time.perf_counter() - t0, "attacks": summary}
+    with open(os.path.join(run_dir, "summary.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{'attack':14s} {'bit acc':>8s} {'ecc acc':>8s} {'recovered':>9s} {'psnr':>7s}")
+    for spec, s in summary.items():
+        psnr_s = f"{s['psnr']:7.2f}" if s["psnr"] is not None else "    inf"
+        print(f"{spec:14s} {s['bit_accuracy']*100:7.2f}% {s['ecc_accuracy']*100:7.2f}% "
+              f"{s['recovered']*100:8.1f}% {psnr_s}")
+    print(f"Wrote {os.path.join(run_dir, 'summary.json')}")
+
+
+if __name__ == "__main__":
+    main()
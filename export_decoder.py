@@ -0,0 +1,147 @@
+"""Export int8-quantized / TorchScript / ONNX decoder artifacts and compare them
+against the float model on datasets/val.
+
+    python export_decoder.py                 # dynamic int8 + TorchScript
+    python export_decoder.py --static --onnx # also static int8 and ONNX
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao import quantization as tq
+
+from backends import DECODER_ARTIFACTS, OnnxDecoder
+from dataset import generate_payload_bits
+from model import EncoderCNN, DecoderCNN
+
+CHECKPOINTS = "checkpoints"
+VAL_DIR = os.path.join("datasets", "val")
+PAYLOAD_SIZE = 1024
+
+
+# --- Quantization ---
+def quantize_dynamic(decoder):
+    """int8 weights for the 32K x 1024 fc layer; activations quantized on the fly."""
+    return tq.quantize_dynamic(decoder, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(decoder, calibration_images, backend="fbgemm"):
+    """Quantize convs and fc with activation ranges observed on calibration_images."""
+    torch.backends.quantized.engine = backend
+    model = tq.QuantWrapper(decoder)
+    model.qconfig = tq.get_default_qconfig(backend)
+    tq.prepare(model, inplace=True)
+    with torch.no_grad():
+        for img in calibration_images:
+            model(img)
+    return tq.convert(model, inplace=True)
+
+
+# --- Evaluation ---
+def load_val_images(val_dir, size):
+    images = []
+    for name in sorted(os.listdir(val_dir)):
+        if not name.lower().endswith((".png", ".jpg", ".jpeg")):
+            continue
+        img = cv2.imread(os.path.join(val_dir, name), cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        img = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), (size, size), interpolation=cv2.INTER_AREA)
+        images.append(torch.from_numpy(img).permute(2, 0, 1).float().div(255.0).unsqueeze(0))
+    if not images:
+        raise FileNotFoundError(f"No validation images in {val_dir}")
+    return images
+
+
+def bit_accuracy(pred, payload):
+    return ((pred > 0.5) == (payload > 0.5)).float().mean().item()
+
+
+def evaluate(decoder, watermarked, payloads, repeats=3):
+    """Mean bit accuracy and median per-image latency (ms) of decoder."""
+    accs, times = [], []
+    with torch.no_grad():
+        for img, payload in zip(watermarked, payloads):
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                pred = decoder(img)
+                times.append(time.perf_counter() - t0)
+            accs.append(bit_accuracy(pred, payload))
+    return {"bit_accuracy": float(np.mean(accs)), "latency_ms": float(np.median(times) * 1000)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checkpoints", default=CHECKPOINTS)
+    parser.add_argument("--val", default=VAL_DIR)
+    parser.add_argument("--size", type=int, default=256, help="validation images are resized to size x size")
+    parser.add_argument("--static", action="store_true", help="also export a statically quantized decoder")
+    parser.add_argument("--onnx", action="store_true", help="also export decoder.onnx (float)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(args.seed)
+
+    encoder = EncoderCNN()
+    encoder.load_state_dict(torch.load(os.path.join(args.checkpoints, "encoder.pth"), map_location="cpu"))
+    encoder.eval()
+    decoder = DecoderCNN(payload_size=PAYLOAD_SIZE)
+    decoder.load_state_dict(torch.load(os.path.join(args.checkpoints, "decoder.pth"), map_location="cpu"))
+    decoder.eval()
+
+    images = load_val_images(args.val, args.size)
+    bits = generate_payload_bits(len(images), PAYLOAD_SIZE, np.random.default_rng(args.seed))
+    payloads = [torch.from_numpy(row).float().unsqueeze(0) for row in bits]
+    with torch.no_grad():
+        watermarked = [encoder(img, p) for img, p in zip(images, payloads)]
+    example = watermarked[0]
+
+    report = {"val_images": len(images), "size": args.size, "backends": {}}
+    report["backends"]["float"] = evaluate(decoder, watermarked, payloads)
+
+    def save_script(name, model):
+        path = os.path.join(args.checkpoints, DECODER_ARTIFACTS[name])
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(model, example).eval())
+        scripted.save(path)
+        report["backends"][name] = evaluate(torch.jit.load(path), watermarked, payloads)
+        report["backends"][name]["size_mb"] = os.path.getsize(path) / 2**20
+
+    save_script("torchscript", decoder)
+    save_script("int8", quantize_dynamic(decoder))
+    if args.static:
+        static_src = DecoderCNN(payload_size=PAYLOAD_SIZE)
+        static_src.load_state_dict(decoder.state_dict())
+        save_script("int8-static", quantize_static(static_src.eval(), watermarked))
+
+    if args.onnx:
+        path = os.path.join(args.checkpoints, DECODER_ARTIFACTS["onnx"])
+        torch.onnx.export(decoder, example, path, input_names=["image"], output_names=["payload"],
+                          dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"}, "payload": {0: "batch"}},
+                          opset_version=17)
+        report["backends"]["onnx"] = evaluate(OnnxDecoder(path), watermarked, payloads)
+        report["backends"]["onnx"]["size_mb"] = os.path.getsize(path) / 2**20
+
+    base = report["backends"]["float"]
+    base["size_mb"] = os.path.getsize(os.path.join(args.checkpoints, "decoder.pth")) / 2**20
+    for name, stats in report["backends"].items():
+        stats["accuracy_delta"] = stats["bit_accuracy"] - base["bit_accuracy"]
+        stats["speedup"] = base["latency_ms"] / max(stats["latency_ms"], 1e-9)
+        print(f"{name:12s} acc={stats['bit_accuracy']*100:6.2f}% "
+              f"(Δ {stats['accuracy_delta']*100:+.2f}) latency={stats['latency_ms']:7.2f}ms "
+              f"x{stats['speedup']:.2f} size={stats['size_mb']:.1f}MB")
+
+    with open(os.path.join(args.checkpoints, "export_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
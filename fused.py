@@ -0,0 +1,104 @@
+# fused.py
+"""uint8-in / uint8-out wrappers around EncoderCNN and DecoderCNN.
+
+OpenCV decodes to HxWx3 BGR uint8. Viewed as (1,3,H,W) that buffer already
+has the channels_last layout, so the only full-size copy on the way in is the
+uint8 → float cast on the model's device. The BGR order is folded into the
+weights of the first convolution (and of the encoder's output convolution),
+so channels are never swapped in memory. On the way out the float result is
+scaled in place, cast to uint8, and its NHWC view is handed back as a numpy
+array ready for cv2.imencode.
+"""
+import copy
+
+import torch
+import torch.nn as nn
+
+from model import DecoderCNN, LiteDecoderCNN
+
+BGR = [2, 1, 0]
+
+
+def _permuted_conv(conv, in_perm=None, out_perm=None):
+    """Copy of conv with its input and/or output channels reordered."""
+    new = copy.deepcopy(conv)
+    with torch.no_grad():
+        w = conv.weight
+        if in_perm is not None:
+            w = w[:, in_perm]
+        if out_perm is not None:
+            w = w[out_perm]
+        new.weight = nn.Parameter(w.contiguous(memory_format=torch.channels_last), requires_grad=False)
+        if conv.bias is not None and out_perm is not None:
+            new.bias = nn.Parameter(conv.bias[out_perm].clone(), requires_grad=False)
+    return new
+
+
+def _with_children(model, overrides):
+    """Instance of model's class sharing every submodule except ``overrides`` (no weight copies)."""
+    clone = copy.copy(model)  # keeps buffers (EncoderCNN.residual_scale) and plain attributes
+    clone._modules = {**model._modules, **overrides}
+    return clone.eval()
+
+
+# --- Layout helpers ---
+def bgr_to_tensor(bgr, device):
+    """HxWx3 (or NxHxWx3) uint8 BGR array → (N,3,H,W) float 0..1 in channels_last, one copy."""
+    t = torch.from_numpy(bgr)
+    if t.dim() == 3:
+        t = t.unsqueeze(0)
+    return t.permute(0, 3, 1, 2).to(device=device, dtype=torch.float32).div_(255.0)
+
+
+def tensor_to_bgr(x):
+    """(N,3,H,W) float 0..1 → (N,H,W,3) uint8 numpy array. Scales ``x`` in place."""
+    x = x.detach().mul_(255.0).clamp_(0, 255).to(torch.uint8)
+    return x.permute(0, 2, 3, 1).cpu().contiguous().numpy()
+
+
+# --- Wrappers ---
+class FusedEncoder(nn.Module):
+    """EncoderCNN that works in BGR order.
+
+    ``model(images, payloads)`` takes and returns (N,3,H,W) BGR float tensors
+    (what the micro-batcher and the tiled encoder feed it); ``forward`` takes
+    an (N,H,W,3) BGR uint8 tensor and returns the same layout.
+    """
+
+    def __init__(self, encoder):
+        super().__init__()
+        self.model = _with_children(encoder, {
+            "conv1": _permuted_conv(encoder.conv1, in_perm=BGR + [3]),  # channel 3 is the payload map
+            "conv2": _permuted_conv(encoder.conv2, out_perm=BGR),
+        })
+
+    def forward(self, bgr, payload):
+        x = bgr.permute(0, 3, 1, 2).float().div_(255.0)
+        out = self.model(x, payload)
+        return out.mul_(255.0).clamp_(0, 255).to(torch.uint8).permute(0, 2, 3, 1)
+
+
+class FusedDecoder(nn.Module):
+    """DecoderCNN that works in BGR order; only conv1 is re-laid out, the rest is shared.
+
+    Exported backends (TorchScript, ONNX) cannot be re-weighted, so for those
+    the channels are flipped on the float tensor instead.
+    """
+
+    def __init__(self, decoder):
+        super().__init__()
+        if isinstance(decoder, (DecoderCNN, LiteDecoderCNN)):
+            self.model = _with_children(decoder, {"conv1": _permuted_conv(decoder.conv1, in_perm=BGR)})
+            self.flip = False
+        else:
+            self.backend = decoder
+            self.flip = True
+
+    def decode_float(self, x):
+        """(N,3,H,W) BGR float → (N,P) probabilities."""
+        if self.flip:
+            return self.backend(x.flip(1))
+        return self.model(x)
+
+    def forward(self, bgr):
+        return self.decode_float(bgr.permute(0, 3, 1, 2).float().div_(255.0))
@@ -0,0 +1,364 @@
+# inference.py
+"""Inference-server mode: dedicated model-owner processes fed through shared memory.
+
+    python inference.py --workers 2 --threads 8 --pin-cores
+    INFERENCE_SOCKETS=/tmp/fingerprint-inference gunicorn -w 4 'app:create_app()'
+
+Each model-owner process loads the models once (via service.load_models), pins
+its intra-op thread count (and optionally its CPU set) and listens on
+``<socket_dir>/owner-<i>.sock``. HTTP front-end processes connect with
+``InferenceClient``: every connection owns a shared-memory ring of fixed-size
+slots. The client writes the decoded uint8 BGR image into a free slot and
+sends only (request id, op, slot, shape) over the socket; the owner runs the
+request through its micro-batchers and writes the result back into the same
+slot. Pixels are never pickled.
+
+Connections are authenticated with INFERENCE_AUTHKEY. If it is unset,
+``python inference.py`` generates a key and writes it to
+``<socket_dir>/authkey`` (mode 0600), where clients read it. A client drops
+an owner whose connection fails, sends the request to another owner and
+retries the dead one (rescanning a socket directory for owners started since)
+after INFERENCE_RECONNECT_SECONDS. A request that finds every slot of its
+connection busy for INFERENCE_SLOT_TIMEOUT_SECONDS fails with TimeoutError.
+"""
+import argparse
+import itertools
+import os
+import queue
+import secrets
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import AuthenticationError, get_context, resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+INFERENCE_DIR = os.environ.get("INFERENCE_DIR", "/tmp/fingerprint-inference")
+INFERENCE_AUTHKEY = os.environ.get("INFERENCE_AUTHKEY", "")  # empty: generated by main() into <dir>/authkey
+INFERENCE_SLOTS = int(os.environ.get("INFERENCE_SLOTS", "8"))
+INFERENCE_SLOT_MB = float(os.environ.get("INFERENCE_SLOT_MB", "48"))  # 48 MB fits a 4096x4096 BGR image
+INFERENCE_CONCURRENCY = int(os.environ.get("INFERENCE_CONCURRENCY", "32"))
+INFERENCE_RECONNECT_SECONDS = float(os.environ.get("INFERENCE_RECONNECT_SECONDS", "5"))
+INFERENCE_SLOT_TIMEOUT_SECONDS = float(os.environ.get("INFERENCE_SLOT_TIMEOUT_SECONDS", "30"))
+AUTHKEY_FILE = "authkey"
+
+
+def socket_paths(spec):
+    """INFERENCE_SOCKETS value (a directory or comma-separated socket paths) → socket paths."""
+    if os.path.isdir(spec):
+        return sorted(os.path.join(spec, n) for n in os.listdir(spec) if n.endswith(".sock"))
+    return [p for p in spec.split(",") if p]
+
+
+def authkey_for(socket_path):
+    """INFERENCE_AUTHKEY, or the key main() wrote next to the socket."""
+    if INFERENCE_AUTHKEY:
+        return INFERENCE_AUTHKEY.encode()
+    path = os.path.join(os.path.dirname(socket_path), AUTHKEY_FILE)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"{path} not found: set INFERENCE_AUTHKEY or start the owners "
+                                "with python inference.py") from None
+
+
+def write_authkey(directory, key):
+    fd = os.open(os.path.join(directory, AUTHKEY_FILE), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+
+
+def attach_shared_memory(name):
+    """Attach to a segment created elsewhere without letting this process's tracker unlink it."""
+    try:
+        return SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        shm = SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def slot_array(shm, slot, slot_bytes, shape, dtype):
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot * slot_bytes)
+
+
+# --- Model owner ---
+def _owner_main(index, socket_path, threads, cores, authkey):
+    import torch
+    if cores:
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    import service  # model loading, batchers and helpers
+    service.warmup(local=True)  # this process is the backend
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = Listener(socket_path, "AF_UNIX", authkey=authkey)
+    pool = ThreadPoolExecutor(INFERENCE_CONCURRENCY, thread_name_prefix=f"owner-{index}")
+    print(f"owner {index}: {threads} threads{f' on cores {sorted(cores)}' if cores else ''}, "
+          f"listening on {socket_path}", flush=True)
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception:
+            continue  # failed handshake
+        threading.Thread(target=_serve_connection, args=(service, conn, pool), daemon=True).start()
+
+
+def _serve_connection(service, conn, pool):
+    send_lock = threading.Lock()
+    try:
+        ring_name, slot_bytes = conn.recv()
+        shm = attach_shared_memory(ring_name)
+        while True:
+            req_id, op, slot, shape, extra = conn.recv()
+            pool.submit(_handle, service, conn, send_lock, shm, slot_bytes, req_id, op, slot, shape, extra)
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def _handle(service, conn, send_lock, shm, slot_bytes, req_id, op, slot, shape, extra):
+    import torch
+    try:
+        img_bgr = slot_array(shm, slot, slot_bytes, shape, np.uint8)
+        if op == "embed":
+            payload = torch.from_numpy(np.unpackbits(extra)[:service.PAYLOAD_SIZE][None]).float().to(service.device)
+            img_bgr[...] = service.watermark_image(img_bgr, payload)  # result overwrites the input in the same slot
+        elif op == "decode":
+            img_tensor = service.bgr_to_tensor(img_bgr, service.device)
+            probs = service._decode_batcher(img_tensor).reshape(-1).float().cpu().numpy()
+            slot_array(shm, slot, slot_bytes, probs.shape, np.float32)[...] = probs
+        elif op != "ping":
+            raise ValueError(f"Unknown op {op!r}")
+        reply = (req_id, None)
+    except Exception as e:
+        reply = (req_id, f"{type(e).__name__}: {e}")
+    with send_lock:
+        try:
+            conn.send(reply)
+        except OSError:
+            pass
+
+
+# --- Front-end client ---
+class _OwnerConnection:
+    def __init__(self, path, slots, slot_bytes, slot_timeout=INFERENCE_SLOT_TIMEOUT_SECONDS):
+        self.path = path
+        self.slot_bytes = slot_bytes
+        self.slot_timeout = slot_timeout
+        self.shm = SharedMemory(create=True, size=slots * slot_bytes)
+        self.free = queue.Queue()
+        for i in range(slots):
+            self.free.put(i)
+        self.pending = {}
+        self.inflight = 0
+        self.alive = True
+        self.lock = threading.Lock()
+        try:
+            self.conn = Client(path, "AF_UNIX", authkey=authkey_for(path))
+            self.conn.send((self.shm.name, slot_bytes))
+        except BaseException:
+            self.shm.close()
+            self.shm.unlink()
+            raise
+        threading.Thread(target=self._read_replies, name="inference-replies", daemon=True).start()
+
+    def _read_replies(self):
+        try:
+            while True:
+                req_id, error = self.conn.recv()
+                fut = self.pending.pop(req_id)
+                if error:
+                    fut.set_exception(RuntimeError(error))
+                else:
+                    fut.set_result(None)
+        except (EOFError, OSError) as e:
+            self.alive = False
+            for fut in list(self.pending.values()):
+                fut.set_exception(ConnectionError(f"inference worker went away: {e}"))
+
+    def call(self, req_id, op, img_rgb, extra=None):
+        """Run one request; returns (slot, release) — read the result from the slot, then release()."""
+        if img_rgb.nbytes > self.slot_bytes:
+            raise ValueError(f"Image too large for INFERENCE_SLOT_MB ({img_rgb.nbytes / 2**20:.1f} MB)")
+        try:
+            slot = self.free.get(timeout=self.slot_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no free inference slot on {self.path} within {self.slot_timeout:g}s") from None
+        with self.lock:
+            self.inflight += 1
+        try:
+            slot_array(self.shm, slot, self.slot_bytes, img_rgb.shape, np.uint8)[...] = img_rgb
+            fut = Future()
+            self.pending[req_id] = fut
+            with self.lock:
+                try:
+                    self.conn.send((req_id, op, slot, img_rgb.shape, extra))
+                except OSError as e:
+                    self.alive = False
+                    raise ConnectionError(f"inference worker went away: {e}") from e
+            fut.result()
+        except BaseException:
+            self.pending.pop(req_id, None)
+            self._done(slot)
+            raise
+        return slot, lambda: self._done(slot)
+
+    def _done(self, slot):
+        with self.lock:
+            self.inflight -= 1
+        self.free.put(slot)
+
+    def close(self):
+        self.alive = False
+        self.conn.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class InferenceClient:
+    """Thread-safe front-end handle; each call goes to the live owner with the fewest requests in flight.
+
+    ``sockets`` is an INFERENCE_SOCKETS value (see socket_paths). Owners whose
+    connection fails are dropped and reconnected at most every
+    ``reconnect_seconds``, when a socket directory is also rescanned; requests
+    meanwhile go to the remaining owners.
+    """
+
+    def __init__(self, sockets, slots=INFERENCE_SLOTS, slot_mb=INFERENCE_SLOT_MB,
+                 reconnect_seconds=INFERENCE_RECONNECT_SECONDS):
+        if not sockets:
+            raise ValueError("No inference worker sockets")
+        self.sockets = sockets
+        self.paths = socket_paths(sockets)
+        self._rescan_at = 0.0
+        self.slots = slots
+        self.slot_bytes = int(slot_mb * 2**20)
+        self.reconnect_seconds = reconnect_seconds
+        self.owners = {}
+        self._dead = []  # dropped connections, closed once their last request is released
+        self._retry_at = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._live_owners()
+
+    def _live_owners(self):
+        """Connected owners, after dropping dead ones and retrying those due for a reconnect."""
+        with self._lock:
+            now = time.monotonic()
+            if self._rescan_at <= now and (len(self.owners) < len(self.paths) or not self.paths
+                                           or not all(o.alive for o in self.owners.values())):
+                self.paths = socket_paths(self.sockets)  # owners may have started (or moved) since
+                self._rescan_at = now + self.reconnect_seconds
+            for path in self.paths:
+                owner = self.owners.get(path)
+                if owner is not None and not owner.alive:
+                    self._dead.append(self.owners.pop(path))
+                    owner = None
+                if owner is None and self._retry_at.get(path, 0) <= now:
+                    try:
+                        self.owners[path] = _OwnerConnection(path, self.slots, self.slot_bytes)
+                    except (OSError, EOFError, AuthenticationError):
+                        self._retry_at[path] = now + self.reconnect_seconds
+            for owner in [o for o in self._dead if not o.inflight]:
+                self._dead.remove(owner)
+                owner.close()
+            return list(self.owners.values())
+
+    def _call(self, op, img_bgr, extra, result_shape, result_dtype):
+        """Run op on the least-loaded owner; on a dead connection, once more on another."""
+        tried = set()
+        while True:
+            owners = [o for o in self._live_owners() if o.path not in tried]
+            if not owners:
+                raise ConnectionError(f"no inference worker reachable ({', '.join(self.paths) or self.sockets})")
+            owner = min(owners, key=lambda o: o.inflight)
+            try:
+                slot, release = owner.call(next(self._ids), op, img_bgr, extra)
+            except ConnectionError:
+                tried.add(owner.path)
+                if len(tried) > 1:
+                    raise
+                continue
+            try:
+                return slot_array(owner.shm, slot, owner.slot_bytes, result_shape, result_dtype).copy()
+            finally:
+                release()
+
+    def embed(self, img_bgr, payload_bits):
+        """Watermark a BGR uint8 image with (P,) 0/1 payload bits; returns a BGR uint8 array."""
+        img_bgr = np.ascontiguousarray(img_bgr)
+        return self._call("embed", img_bgr, np.packbits(payload_bits), img_bgr.shape, np.uint8)
+
+    def decode(self, img_bgr, payload_size=1024):
+        """Decoder probabilities (payload_size,) float32 for a BGR uint8 image."""
+        return self._call("decode", np.ascontiguousarray(img_bgr), None, (payload_size,), np.float32)
+
+    def ping(self):
+        """Raise unless every owner answers."""
+        owners = self._live_owners()
+        if not owners or len(owners) < len(self.paths):
+            raise ConnectionError("inference workers unreachable: "
+                                  + (", ".join(p for p in self.paths if p not in self.owners) or self.sockets))
+        for owner in owners:
+            slot, release = owner.call(next(self._ids), "ping", np.zeros((1, 1, 3), np.uint8))
+            release()
+
+    def close(self):
+        with self._lock:
+            for owner in list(self.owners.values()) + self._dead:
+                owner.close()
+            self.owners.clear()
+            self._dead.clear()
+
+
+# --- Server CLI ---
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run dedicated model-owner processes for app.py.")
+    parser.add_argument("--workers", type=int, default=1, help="model-owner processes")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads per owner (default: cores / workers)")
+    parser.add_argument("--pin-cores", action="store_true", help="give each owner a disjoint set of CPU cores")
+    parser.add_argument("--dir", default=INFERENCE_DIR, help="directory for the owner-<i>.sock sockets")
+    return parser.parse_args()
+
+
+def _raise_interrupt(*_):
+    raise KeyboardInterrupt
+
+
+def main():
+    args = parse_args()
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    threads = args.threads or max(1, len(cores) // args.workers)
+    os.makedirs(args.dir, mode=0o700, exist_ok=True)
+    authkey = INFERENCE_AUTHKEY.encode() or secrets.token_bytes(32)
+    if not INFERENCE_AUTHKEY:
+        write_authkey(args.dir, authkey)  # front-ends read it from here
+
+    ctx = get_context("spawn")
+    procs = []
+    for i in range(args.workers):
+        owner_cores = set(cores[i * threads:(i + 1) * threads]) if args.pin_cores else None
+        path = os.path.join(args.dir, f"owner-{i}.sock")
+        p = ctx.Process(target=_owner_main, args=(i, path, threads, owner_cores, authkey), name=f"owner-{i}", daemon=True)
+        p.start()
+        procs.append(p)
+
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
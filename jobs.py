@@ -0,0 +1,369 @@
+# jobs.py
+"""Bulk fingerprinting jobs backed by a local SQLite queue.
+
+Uploaded files are written under ``<root>/<job_id>/in`` and queued as items in
+``<root>/jobs.db``. A dispatcher thread claims pending items and runs them in
+a small spawn-based process pool; because the queue lives in SQLite, pending
+and interrupted items are picked up again after a restart.
+
+Every server process may queue jobs, but only the one holding an flock on
+``<root>/dispatcher.lock`` dispatches them, so gunicorn workers (and a
+--preload master) share one pool. The others wait on the lock and take over
+if the dispatcher exits.
+"""
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+import weakref
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import torch
+from werkzeug.utils import secure_filename
+
+from fused import bgr_to_tensor, tensor_to_bgr
+from tiling import encode_tiled
+from utils import IMAGE_FORMATS, decode_image_bytes, encode_image
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): every process dispatches
+    fcntl = None
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    username TEXT NOT NULL,
+    fmt TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    claimed_at REAL,
+    claimed_by INTEGER,
+    metadata TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+"""
+
+
+# --- Worker process ---
+_worker = {}
+
+
+def _init_worker(num_threads):
+    # Keep each pool process from competing with the interactive endpoints.
+    torch.set_num_threads(num_threads)
+    import service  # the server's model loading and metadata helpers, without the Flask app
+    service.load_models()
+    _worker["service"] = service
+
+
+def _fingerprint_file(in_path, out_path, username, fmt):
+    service = _worker["service"]
+    with open(in_path, "rb") as f:
+        img_bgr = decode_image_bytes(f.read(), bgr=True)
+    meta_bytes = service.encode_metadata_plain(username)
+    payload = service.bytes_to_payload_tensor(meta_bytes, service.device)
+    service.register_payload(meta_bytes)
+    img_tensor = bgr_to_tensor(img_bgr, torch.device("cpu"))
+    watermarked = encode_tiled(service._fused_encoder.model, img_tensor, payload)
+    out_bytes, _ = encode_image(tensor_to_bgr(watermarked)[0], fmt, bgr=True)
+    with open(out_path + ".tmp", "wb") as f:
+        f.write(out_bytes)
+    os.replace(out_path + ".tmp", out_path)
+    return meta_bytes.decode("utf-8")
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+# A forked child must not keep its parent's dispatcher lock alive: the lock
+# belongs to the open file, so an inherited descriptor would outlive the parent.
+_managers = weakref.WeakSet()
+
+
+def _drop_lock_after_fork():
+    for manager in list(_managers):
+        if manager._lock_fd is not None:
+            os.close(manager._lock_fd)
+            manager._lock_fd = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_drop_lock_after_fork)
+
+
+# --- Job manager ---
+class JobManager:
+    def __init__(self, root, workers=1, threads_per_worker=1, max_running_jobs=2,
+                 max_files=10000, max_expanded_bytes=2 * 2**30, stale_seconds=600):
+        self.root = root
+        self.db_path = os.path.join(root, "jobs.db")
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.max_running_jobs = max_running_jobs
+        self.max_files = max_files
+        self.max_expanded_bytes = max_expanded_bytes
+        self.stale_seconds = stale_seconds
+        self._wake = threading.Event()
+        self._pid = None
+        self._pool = None
+        self._lock_fd = None
+        _managers.add(self)
+        os.makedirs(root, exist_ok=True)
+        with self._db() as db:
+            db.executescript(SCHEMA)
+            columns = {r["name"] for r in db.execute("PRAGMA table_info(items)")}
+            if "claimed_by" not in columns:  # queues created before claims recorded the dispatcher pid
+                db.execute("ALTER TABLE items ADD COLUMN claimed_by INTEGER")
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.row_factory = sqlite3.Row
+        return db
+
+    @contextlib.contextmanager
+    def _db(self):
+        db = self._connect()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _job_dir(self, job_id, sub=""):
+        return os.path.join(self.root, job_id, sub)
+
+    # --- Submission ---
+    def submit(self, uploads, username="anonymous", fmt="png"):
+        """Queue (filename, bytes) uploads; .zip archives are expanded. Returns the job id."""
+        job_id = uuid.uuid4().hex
+        in_dir, out_dir = self._job_dir(job_id, "in"), self._job_dir(job_id, "out")
+        os.makedirs(in_dir)
+        os.makedirs(out_dir)
+
+        try:
+            names = []
+            for filename, data in self._expand(uploads):
+                if len(names) >= self.max_files:
+                    raise ValueError(f"Too many files (limit {self.max_files})")
+                name = f"{len(names):06d}_{secure_filename(os.path.basename(filename)) or 'image'}"
+                with open(os.path.join(in_dir, name), "wb") as f:
+                    f.write(data)
+                names.append(name)
+            if not names:
+                raise ValueError("No images in upload")
+        except BaseException:
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+            raise
+
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, 'queued')",
+                       (job_id, time.time(), username, fmt, len(names)))
+            db.executemany("INSERT INTO items (job_id, idx, name, status) VALUES (?, ?, ?, 'pending')",
+                           [(job_id, i, n) for i, n in enumerate(names)])
+            db.execute("COMMIT")
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def _expand(self, uploads):
+        # zf.read never returns more than the member's declared file_size, so checking
+        # the header bounds what an archive can expand to.
+        left = self.max_expanded_bytes
+        for filename, data in uploads:
+            if filename.lower().endswith(".zip"):
+                try:
+                    zf = zipfile.ZipFile(io.BytesIO(data))
+                except zipfile.BadZipFile:
+                    raise ValueError(f"Not a valid zip archive: {filename}")
+                with zf:
+                    for info in zf.infolist():
+                        if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                            if info.file_size > left:
+                                raise ValueError(f"Archives expand past the limit "
+                                                 f"({self.max_expanded_bytes / 2**20:.0f} MB)")
+                            left -= info.file_size
+                            yield info.filename, zf.read(info)
+            elif filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield filename, data
+
+    # --- Status / results ---
+    def status(self, job_id):
+        with self._db() as db:
+            job = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status",
+                                     (job_id,)).fetchall())
+            errors = [dict(r) for r in db.execute(
+                "SELECT name, error FROM items WHERE job_id = ? AND status = 'failed' LIMIT 20", (job_id,))]
+        done = counts.get("done", 0) + counts.get("failed", 0)
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "total": job["total"],
+            "completed": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0) + counts.get("running", 0),
+            "progress": done / job["total"],
+            "errors": errors,
+        }
+
+    def archive_path(self, job_id):
+        """Path of the results zip (built once the job is done), or None if not ready."""
+        status = self.status(job_id)
+        if status is None or status["status"] != "done":
+            return None
+        path = self._job_dir(job_id, "results.zip")
+        if not os.path.exists(path):
+            self._build_archive(job_id, path)
+        return path
+
+    def _build_archive(self, job_id, path):
+        with self._db() as db:
+            rows = db.execute("SELECT name, metadata FROM items WHERE job_id = ? AND status = 'done' ORDER BY idx",
+                              (job_id,)).fetchall()
+            fmt = db.execute("SELECT fmt FROM jobs WHERE id = ?", (job_id,)).fetchone()["fmt"]
+        out_dir = self._job_dir(job_id, "out")
+        with zipfile.ZipFile(path + ".tmp", "w", zipfile.ZIP_STORED) as zf:
+            manifest = []
+            for row in rows:
+                out_name = self._output_name(row["name"], fmt)
+                zf.write(os.path.join(out_dir, out_name), out_name)
+                manifest.append(f"{out_name}\t{row['metadata']}")
+            zf.writestr("manifest.tsv", "\n".join(manifest) + "\n")
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _output_name(name, fmt):
+        return f"fingerprinted_{os.path.splitext(name)[0]}{IMAGE_FORMATS[fmt][1]}"
+
+    # --- Dispatcher ---
+    def start(self):
+        """Start (or, after a fork, restart) the dispatcher thread; it dispatches once elected."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pool = None
+        threading.Thread(target=self._dispatch, name="bulk-dispatcher", daemon=True).start()
+
+    def _elect(self):
+        """Block until this process holds the dispatcher lock."""
+        if fcntl is None:
+            return
+        fd = os.open(os.path.join(self.root, "dispatcher.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._lock_fd = fd
+                return
+            except BlockingIOError:
+                time.sleep(5.0)  # another process dispatches; take over when it exits
+
+    def _claim(self, db, limit):
+        db.execute("BEGIN IMMEDIATE")
+        rows = db.execute(
+            "SELECT i.job_id, i.idx, i.name, j.username, j.fmt FROM items i JOIN jobs j ON j.id = i.job_id "
+            "WHERE i.status = 'pending' AND j.id IN "
+            "(SELECT id FROM jobs WHERE status != 'done' ORDER BY created LIMIT ?) "
+            "ORDER BY j.created, i.idx LIMIT ?", (self.max_running_jobs, limit)).fetchall()
+        now = time.time()
+        for r in rows:
+            db.execute("UPDATE items SET status = 'running', claimed_at = ?, claimed_by = ? "
+                       "WHERE job_id = ? AND idx = ?", (now, os.getpid(), r["job_id"], r["idx"]))
+            db.execute("UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'queued'", (r["job_id"],))
+        db.execute("COMMIT")
+        return rows
+
+    def _requeue_stale(self, db):
+        db.execute("UPDATE items SET status = 'pending' WHERE status = 'running' AND claimed_at < ?",
+                   (time.time() - self.stale_seconds,))
+
+    def _requeue_orphaned(self, db):
+        """Requeue items claimed by dispatchers that are no longer running (BULK_DIR is host-local)."""
+        owners = [r[0] for r in db.execute("SELECT DISTINCT claimed_by FROM items WHERE status = 'running'")]
+        for pid in owners:
+            if pid is None or not _pid_alive(pid):
+                db.execute("UPDATE items SET status = 'pending' WHERE status = 'running' AND claimed_by IS ?",
+                           (pid,))
+
+    def _finish(self, db, job_id, idx, metadata=None, error=None):
+        db.execute("UPDATE items SET status = ?, metadata = ?, error = ? WHERE job_id = ? AND idx = ?",
+                   ("failed" if error else "done", metadata, error, job_id, idx))
+        left = db.execute("SELECT COUNT(*) FROM items WHERE job_id = ? AND status IN ('pending', 'running')",
+                          (job_id,)).fetchone()[0]
+        if left == 0:
+            db.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (job_id,))
+
+    def _dispatch(self):
+        self._elect()
+        db = self._connect()
+        # Items left 'running' by a dead dispatcher (e.g. before a restart) are requeued now;
+        # anything else that hangs is requeued once it goes stale.
+        self._requeue_orphaned(db)
+        self._requeue_stale(db)
+        inflight = {}
+        max_inflight = self.workers * 2
+        while True:
+            try:
+                if len(inflight) < max_inflight:
+                    for r in self._claim(db, max_inflight - len(inflight)):
+                        inflight[self._submit(r)] = (r["job_id"], r["idx"])
+
+                if not inflight:
+                    self._requeue_stale(db)
+                    # Jobs queued by other server processes cannot set _wake; poll for them.
+                    self._wake.wait(timeout=1.0)
+                    self._wake.clear()
+                    continue
+
+                done, _ = wait(inflight, timeout=1.0, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    job_id, idx = inflight.pop(fut)
+                    try:
+                        self._finish(db, job_id, idx, metadata=fut.result())
+                    except BrokenProcessPool as e:
+                        self._pool = None  # recreated on the next claim
+                        self._finish(db, job_id, idx, error=f"worker crashed: {e}")
+                    except Exception as e:
+                        self._finish(db, job_id, idx, error=str(e))
+            except Exception:
+                traceback.print_exc()
+                time.sleep(1.0)
+
+    def _submit(self, row):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=mp.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(self.threads_per_worker,))
+        in_path = os.path.join(self._job_dir(row["job_id"], "in"), row["name"])
+        out_path = os.path.join(self._job_dir(row["job_id"], "out"), self._output_name(row["name"], row["fmt"]))
+        return self._pool.submit(_fingerprint_file, in_path, out_path, row["username"], row["fmt"])
@@ -0,0 +1,173 @@
+# metrics.py
+"""Per-stage request timing and a Prometheus text exposition.
+
+Endpoints wrapped with ``instrument(endpoint)`` get a per-request timer;
+code anywhere below them records stages with ``with span("forward"): ...``
+(a no-op outside an instrumented request). On completion each stage is
+observed into a histogram labelled by endpoint, stage and image-size bucket.
+"""
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import make_response, request
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = ((0.25, "lt_0.25mp"), (1.0, "lt_1mp"), (4.0, "lt_4mp"), (16.0, "lt_16mp"))
+PROFILE_HEADER = "X-Profile"
+
+_lock = threading.Lock()
+_histograms = {}   # (endpoint, stage, size) -> [bucket counts..., sum, count]
+_requests = {}     # (endpoint, status) -> count
+_in_flight = {}    # endpoint -> count
+_gauges = []       # (name, help, fn) where fn() -> {labels dict as tuple of pairs: value} or value
+_local = threading.local()
+
+
+def size_bucket(h, w):
+    mp = h * w / 1e6
+    for limit, label in SIZE_BUCKETS:
+        if mp < limit:
+            return label
+    return "ge_16mp"
+
+
+class RequestTimer:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.size = "unknown"
+        self.stages = []  # (stage, seconds) in order
+
+    def add(self, stage, seconds):
+        self.stages.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    timer = getattr(_local, "timer", None)
+    if timer is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(stage, time.perf_counter() - t0)
+
+
+def set_image_size(h, w):
+    timer = getattr(_local, "timer", None)
+    if timer is not None:
+        timer.size = size_bucket(h, w)
+
+
+def observe(endpoint, stage, size, seconds):
+    key = (endpoint, stage, size)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+
+def register_gauge(name, help_text, fn):
+    _gauges.append((name, help_text, fn))
+
+
+def instrument(endpoint):
+    """Decorator for Flask views: in-flight tracking, stage histograms, Server-Timing on request."""
+    def wrap(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            timer = RequestTimer(endpoint)
+            _local.timer = timer
+            with _lock:
+                _in_flight[endpoint] = _in_flight.get(endpoint, 0) + 1
+            t0 = time.perf_counter()
+            status = 500
+            try:
+                resp = make_response(view(*args, **kwargs))
+                status = resp.status_code
+                total = time.perf_counter() - t0
+                if request.headers.get(PROFILE_HEADER):
+                    parts = [f"{stage};dur={sec * 1000:.2f}" for stage, sec in timer.stages]
+                    parts.append(f"total;dur={total * 1000:.2f}")
+                    resp.headers["Server-Timing"] = ", ".join(parts)
+                return resp
+            finally:
+                total = time.perf_counter() - t0
+                _local.timer = None
+                for stage, sec in timer.stages:
+                    observe(endpoint, stage, timer.size, sec)
+                observe(endpoint, "total", timer.size, total)
+                with _lock:
+                    _in_flight[endpoint] -= 1
+                    _requests[(endpoint, status)] = _requests.get((endpoint, status), 0) + 1
+        return wrapper
+    return wrap
+
+
+def process_memory_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# --- Exposition ---
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text format."""
+    lines = []
+    with _lock:
+        hists = {k: list(v) for k, v in _histograms.items()}
+        reqs = dict(_requests)
+        in_flight = dict(_in_flight)
+
+    lines += ["# HELP fingerprint_stage_seconds Time spent per request stage.",
+              "# TYPE fingerprint_stage_seconds histogram"]
+    for (endpoint, stage, size), hist in sorted(hists.items()):
+        base = [("endpoint", endpoint), ("stage", stage), ("size", size)]
+        for bound, count in zip(BUCKETS, hist):
+            lines.append(f"fingerprint_stage_seconds_bucket{_labels(base + [('le', bound)])} {count}")
+        lines.append(f"fingerprint_stage_seconds_bucket{_labels(base + [('le', '+Inf')])} {hist[-1]}")
+        lines.append(f"fingerprint_stage_seconds_sum{_labels(base)} {hist[-2]:.6f}")
+        lines.append(f"fingerprint_stage_seconds_count{_labels(base)} {hist[-1]}")
+
+    lines += ["# HELP fingerprint_requests_total Requests by endpoint and status.",
+              "# TYPE fingerprint_requests_total counter"]
+    for (endpoint, status), count in sorted(reqs.items()):
+        lines.append(f"fingerprint_requests_total{_labels([('endpoint', endpoint), ('status', status)])} {count}")
+
+    lines += ["# HELP fingerprint_requests_in_flight Requests currently being handled.",
+              "# TYPE fingerprint_requests_in_flight gauge"]
+    for endpoint, count in sorted(in_flight.items()):
+        lines.append(f"fingerprint_requests_in_flight{_labels([('endpoint', endpoint)])} {count}")
+
+    gauges = [("process_resident_memory_bytes", "Resident set size of this process.", process_memory_bytes)]
+    for name, help_text, fn in gauges + _gauges:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        if isinstance(value, dict):
+            for pairs, v in sorted(value.items()):
+                if v is not None:
+                    lines.append(f"{name}{_labels(pairs)} {v}")
+        elif value is not None:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
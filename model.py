@@ -3,13 +3,21 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 class EncoderCNN(nn.Module):
-    def __init__(self):
+    def __init__(self, residual_scale=0.1):
         super().__init__()
+        # Max per-pixel change; trades imperceptibility for robustness. A buffer, so
+        # encoder.pth carries the value it was trained with.
+        self.register_buffer("residual_scale", torch.tensor(float(residual_scale)))
         self.conv1 = nn.Conv2d(4, 64, 3, padding=1)
         self.conv2 = nn.Conv2d(64, 3, 3, padding=1)
         self.relu = nn.ReLU()
         self.sigmoid = nn.Sigmoid()
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints from before residual_scale was saved were all trained at the 0.1 default.
+        state_dict.setdefault(prefix + "residual_scale", torch.tensor(0.1))
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
     def forward(self, image, payload):
         b, c, h, w = image.shape
         payload_map = payload.unsqueeze(-1).unsqueeze(-1)
@@ -18,7 +26,7 @@ class EncoderCNN(nn.Module):
         x = torch.cat([image, payload_map], dim=1)
         x = self.relu(self.conv1(x))
         residual = self.sigmoid(self.conv2(x))
-        watermarked = image + residual * 0.1
+        watermarked = image + residual * self.residual_scale
         watermarked = torch.clamp(watermarked, 0, 1)
         return watermarked
 
@@ -41,3 +49,34 @@ class DecoderCNN(nn.Module):
         x = self.flatten(x)
         x = self.sigmoid(self.fc(x))
         return x
+
+class LiteDecoderCNN(nn.Module):
+    """Lighter DecoderCNN for CPU verification: strided convs, fewer channels, optional low-rank head.
+
+    With channels=(64, 64, 32), strides=(1, 1, 1), pool=32 and rank=0 it has
+    DecoderCNN's shape (and state_dict keys). ``config`` rebuilds the model.
+    """
+    def __init__(self, payload_size=1024, channels=(32, 32, 16), strides=(2, 2, 1), pool=16, rank=256):
+        super().__init__()
+        self.config = dict(payload_size=payload_size, channels=list(channels), strides=list(strides),
+                           pool=pool, rank=rank)
+        c1, c2, c3 = channels
+        s1, s2, s3 = strides
+        self.conv1 = nn.Conv2d(3, c1, 3, stride=s1, padding=1)
+        self.conv2 = nn.Conv2d(c1, c2, 3, stride=s2, padding=1)
+        self.conv3 = nn.Conv2d(c2, c3, 3, stride=s3, padding=1)
+        self.adaptive_pool = nn.AdaptiveAvgPool2d((pool, pool))
+        self.flatten = nn.Flatten()
+        # rank > 0 factorizes the head into (features x rank) @ (rank x payload_size).
+        self.fc = nn.Linear(c3*pool*pool, rank or payload_size)
+        self.head = nn.Linear(rank, payload_size) if rank else nn.Identity()
+        self.sigmoid = nn.Sigmoid()
+
+    def forward(self, x):
+        x = F.relu(self.conv1(x))
+        x = F.relu(self.conv2(x))
+        x = F.relu(self.conv3(x))
+        x = self.adaptive_pool(x)
+        x = self.flatten(x)
+        x = self.sigmoid(self.head(self.fc(x)))
+        return x
@@ -0,0 +1,304 @@
+"""Fingerprint or verify whole directory trees without going through HTTP.
+
+    python offline.py embed archive/ fingerprinted/ --username alice --format jpeg
+    python offline.py verify fingerprinted/ --report verify.jsonl
+
+Uses service.py's model loading, metadata and registry helpers in-process
+(INFERENCE_SOCKETS is ignored: the models always run here). Each
+run is a three-stage pipeline joined by bounded queues, so memory stays flat
+however large the tree is:
+
+    reader threads (read + imdecode, --prefetch images ahead)
+      → inference thread (batches of up to --batch-size, grouped by padded size)
+      → writer threads (imencode + atomic write, or payload decode + registry lookup)
+
+embed skips images whose output already exists. verify skips images already in
+the report. Both print images/sec as they go.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+
+import service
+from batching import padded_size
+from fused import bgr_to_tensor, tensor_to_bgr
+from jobs import IMAGE_EXTENSIONS
+from tiling import TILE_SIZE, encode_tiled
+from utils import IMAGE_FORMATS, decode_image_bytes, encode_image
+
+_DONE = object()
+
+
+def list_images(root):
+    """Image paths under root, relative to it, in a stable order."""
+    rels = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                rels.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return rels
+
+
+def output_path(dst, rel, fmt):
+    """Output file for a source image; the source extension is kept so a.png and a.jpg stay distinct."""
+    ext = IMAGE_FORMATS[fmt][1]
+    return os.path.join(dst, rel if rel.lower().endswith(ext) else rel + ext)
+
+
+def read_report(path):
+    """Relative paths already in a verify report."""
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["path"])
+                except ValueError:
+                    continue  # partial line from an interrupted write
+    return done
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._last = 0.0
+
+    def add(self, ok=True):
+        with self._lock:
+            self.done += 1
+            self.failed += not ok
+            now = time.perf_counter()
+            if now - self._last >= 1.0 or self.done == self.total:
+                self._last = now
+                print(f"\r{self.done}/{self.total} images ({self.rate():.1f} img/s, {self.failed} failed)",
+                      end="", flush=True)
+
+    def rate(self):
+        return self.done / max(time.perf_counter() - self.t0, 1e-9)
+
+
+# --- Pipeline stages ---
+def _reader(src, paths, decoded, progress):
+    while True:
+        rel = paths.get()
+        if rel is _DONE:
+            decoded.put(_DONE)
+            return
+        try:
+            with open(os.path.join(src, rel), "rb") as f:
+                decoded.put((rel, decode_image_bytes(f.read(), bgr=True)))
+        except Exception as e:
+            print(f"\n{rel}: {e}")
+            progress.add(ok=False)
+
+
+def _collect(decoded, batch_size, readers_left):
+    """Up to batch_size items: block for the first, then take whatever is already decoded."""
+    items = []
+    while readers_left and len(items) < batch_size:
+        try:
+            item = decoded.get() if not items else decoded.get_nowait()
+        except queue.Empty:
+            break
+        if item is _DONE:
+            readers_left -= 1
+        else:
+            items.append(item)
+    return items, readers_left
+
+
+def _run_batch(run, images, payloads, pad_multiple):
+    """Run same-size groups of BGR uint8 images through run(batch, payloads); returns one result per image."""
+    groups = {}
+    for i, img in enumerate(images):
+        groups.setdefault(padded_size(*img.shape[:2], pad_multiple), []).append(i)
+    results = [None] * len(images)
+    for idx in groups.values():
+        th = max(images[i].shape[0] for i in idx)  # pad to the group's largest image, not the multiple
+        tw = max(images[i].shape[1] for i in idx)
+        batch = []
+        for i in idx:
+            t = bgr_to_tensor(images[i], service.device)
+            h, w = t.shape[-2:]
+            if (h, w) != (th, tw):
+                t = F.pad(t, (0, tw - w, 0, th - h), mode="replicate")
+            batch.append(t)
+        with torch.no_grad():
+            out = run(torch.cat(batch), None if payloads is None else torch.cat([payloads[i] for i in idx]))
+        for b, i in enumerate(idx):
+            h, w = images[i].shape[:2]
+            results[i] = out[b:b + 1, :, :h, :w] if out.dim() == 4 else out[b:b + 1]
+    return results
+
+
+def _embed_stage(decoded, written, args, readers):
+    while readers:
+        items, readers = _collect(decoded, args.batch_size, readers)
+        if not items:
+            continue
+        metas = [service.encode_metadata_plain(args.username) for _ in items]
+        payloads = [service.bytes_to_payload_tensor(m, service.device) for m in metas]
+        small = [i for i, (_, img) in enumerate(items) if max(img.shape[:2]) <= TILE_SIZE]
+        outs = dict(zip(small, _run_batch(service.run_fused_encoder_batch, [items[i][1] for i in small],
+                                          [payloads[i] for i in small], service.BATCH_PAD_MULTIPLE)))
+        for i, (_, img) in enumerate(items):
+            if i not in outs:
+                img_tensor = bgr_to_tensor(img, torch.device("cpu"))  # tiles go to the device batch by batch
+                outs[i] = encode_tiled(service._fused_encoder.model, img_tensor, payloads[i])
+        for i, (rel, _) in enumerate(items):
+            written.put((rel, tensor_to_bgr(outs[i])[0], metas[i].decode("utf-8")))
+
+
+def _verify_stage(decoded, written, args, readers):
+    while readers:
+        items, readers = _collect(decoded, args.batch_size, readers)
+        if items:
+            probs = _run_batch(service.run_fused_decoder_batch, [img for _, img in items], None, 1)
+            for (rel, _), p in zip(items, probs):
+                written.put((rel, p.float().cpu(), None))
+
+
+def _embed_writer(written, args, manifest, lock, progress):
+    while True:
+        item = written.get()
+        if item is _DONE:
+            return
+        rel, img, metadata = item
+        try:
+            out = output_path(args.dst, rel, args.format)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            data, _ = encode_image(img, args.format, args.quality, bgr=True)
+            with open(out + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(out + ".tmp", out)
+            # Register only payloads that actually shipped in a file.
+            service.registry.add(service.payload_bits(metadata.encode("utf-8"))[0], metadata)
+            with lock:
+                manifest.write(json.dumps({"path": rel, "output": os.path.relpath(out, args.dst),
+                                           "metadata": metadata}) + "\n")
+                manifest.flush()
+            progress.add()
+        except Exception as e:
+            print(f"\n{rel}: {e}")
+            progress.add(ok=False)
+
+
+def _verify_writer(written, args, report, lock, progress):
+    while True:
+        item = written.get()
+        if item is _DONE:
+            return
+        rel, probs, _ = item
+        try:
+            fingerprint, timestamp = service.split_metadata(service.payload_tensor_to_string(probs))
+            row = {"path": rel, "fingerprint": fingerprint, "timestamp": timestamp,
+                   "clean": service.payload_is_clean(probs), "registry_match": service.registry_match(probs)}
+            with lock:
+                report.write(json.dumps(row) + "\n")
+                report.flush()
+            progress.add()
+        except Exception as e:
+            print(f"\n{rel}: {e}")
+            progress.add(ok=False)
+
+
+def run_pipeline(todo, args, stage, writer, out_file):
+    """Wire readers → stage → writers with bounded queues and run todo through them."""
+    paths = queue.Queue()
+    decoded = queue.Queue(maxsize=args.prefetch)
+    written = queue.Queue(maxsize=args.prefetch)
+    progress = Progress(len(todo))
+    lock = threading.Lock()
+    for rel in todo:
+        paths.put(rel)
+    for _ in range(args.readers):
+        paths.put(_DONE)
+
+    threads = [threading.Thread(target=_reader, args=(args.src, paths, decoded, progress), daemon=True)
+               for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(written, args, out_file, lock, progress), daemon=True)
+               for _ in range(args.writers)]
+    for t in threads + writers:
+        t.start()
+    try:
+        stage(decoded, written, args, args.readers)
+    finally:
+        # Let the writers flush what was already inferred, even if the stage failed.
+        for _ in writers:
+            written.put(_DONE)
+        for t in writers:
+            t.join()
+    print(f"\n{progress.done - progress.failed} done, {progress.failed} failed "
+          f"in {time.perf_counter() - progress.t0:.1f}s ({progress.rate():.1f} img/s)")
+
+
+# --- Subcommands ---
+def cmd_embed(args):
+    rels = list_images(args.src)
+    outputs = {}
+    for r in rels:
+        outputs.setdefault(output_path(args.dst, r, args.format), []).append(r)
+    clashes = [srcs for srcs in outputs.values() if len(srcs) > 1]
+    if clashes:
+        raise SystemExit(f"these sources map to the same output: {clashes[:5]}")
+    todo = [r for r in rels if not os.path.exists(output_path(args.dst, r, args.format))]
+    print(f"{len(rels)} images, {len(rels) - len(todo)} already fingerprinted → {args.dst}")
+    os.makedirs(args.dst, exist_ok=True)
+    with open(os.path.join(args.dst, "manifest.jsonl"), "a") as manifest:
+        run_pipeline(todo, args, _embed_stage, _embed_writer, manifest)
+
+
+def cmd_verify(args):
+    rels = list_images(args.src)
+    report_path = args.report or os.path.join(args.src, "verify.jsonl")
+    done = read_report(report_path)
+    todo = [r for r in rels if r not in done]
+    print(f"{len(rels)} images, {len(rels) - len(todo)} already verified → {report_path}")
+    with open(report_path, "a") as report:
+        run_pipeline(todo, args, _verify_stage, _verify_writer, report)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    embed = sub.add_parser("embed", help="fingerprint every image under SRC into DST")
+    embed.add_argument("src")
+    embed.add_argument("dst")
+    embed.add_argument("--username", default="anonymous")
+    embed.add_argument("--format", choices=sorted(IMAGE_FORMATS), default="png")
+    embed.add_argument("--quality", type=int, default=None, help="JPEG quality or PNG compression level")
+    embed.set_defaults(func=cmd_embed)
+    verify = sub.add_parser("verify", help="decode the fingerprint of every image under SRC")
+    verify.add_argument("src")
+    verify.add_argument("--report", default=None, help="JSON-lines report (default: SRC/verify.jsonl)")
+    verify.set_defaults(func=cmd_verify)
+    for p in (embed, verify):
+        p.add_argument("--readers", type=int, default=4, help="decode threads")
+        p.add_argument("--writers", type=int, default=4, help="encode/report threads")
+        p.add_argument("--batch-size", type=int, default=service.MAX_BATCH_SIZE)
+        p.add_argument("--prefetch", type=int, default=16, help="images buffered between stages")
+        p.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    service.load_models()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
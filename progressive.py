@@ -0,0 +1,83 @@
+# progressive.py
+"""Coarse-to-fine decoding with an early exit.
+
+DecoderCNN runs its convolutions at the input resolution before pooling to
+32x32, so decode cost grows with the pixel count. ``decode_progressive`` first
+decodes downscaled copies (PROGRESSIVE_LEVELS, longest side in pixels) and
+returns as soon as ``is_clean`` accepts the payload; otherwise it tries a
+batch of native-resolution crops, and finally the full image. Images are
+HxWx3 uint8 arrays in BGR order, as decoded by OpenCV.
+
+The early exit is only as strong as ``is_clean``. app.py passes
+payload_is_clean, which with PAYLOAD_ECC=1 requires clean Hamming syndromes
+and well-formed metadata; with the default PAYLOAD_ECC=0 it is the framing
+check alone, so a downscaled decode with flipped bits inside the username or
+timestamp digits can still exit early. Enable PAYLOAD_ECC alongside
+PROGRESSIVE_DECODE where that matters.
+"""
+import os
+
+import cv2
+
+PROGRESSIVE_LEVELS = [int(s) for s in os.environ.get("PROGRESSIVE_LEVELS", "256,512").split(",") if s]
+PROGRESSIVE_CROP_SIZE = int(os.environ.get("PROGRESSIVE_CROP_SIZE", "512"))
+PROGRESSIVE_CROPS = int(os.environ.get("PROGRESSIVE_CROPS", "5"))
+
+
+def resize_max_side(img_bgr, max_side):
+    """Downscale so the longest side is ``max_side`` pixels."""
+    h, w = img_bgr.shape[:2]
+    scale = max_side / max(h, w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img_bgr, size, interpolation=cv2.INTER_AREA)
+
+
+def crop_grid(img_bgr, size, count=5):
+    """Up to ``count`` equally sized crops: centre first, then the four corners."""
+    h, w = img_bgr.shape[:2]
+    ch, cw = min(size, h), min(size, w)
+    origins = [((h - ch) // 2, (w - cw) // 2), (0, 0), (0, w - cw), (h - ch, 0), (h - ch, w - cw)]
+    return [img_bgr[y:y + ch, x:x + cw] for y, x in origins[:max(1, count)]]
+
+
+def decode_progressive(decode_many, img_bgr, is_clean, levels=None, crop_size=None, crops=None):
+    """Decode the cheapest level whose payload passes ``is_clean``.
+
+    ``decode_many(list of HxWx3 BGR arrays)`` returns (N,P) probabilities and
+    ``is_clean((1,P) probabilities)`` is the early-exit test. Returns
+    (probabilities (1,P), info) where info["level"] names the level that was
+    used ("256px", "crop@512px", "crops-vote@512px" or "full"), info["clean"]
+    whether it passed, and info["attempts"] every level tried in order.
+    """
+    levels = PROGRESSIVE_LEVELS if levels is None else levels
+    crop_size = crop_size or PROGRESSIVE_CROP_SIZE
+    crops = PROGRESSIVE_CROPS if crops is None else crops
+    longest = max(img_bgr.shape[:2])
+    attempts = []
+
+    for side in sorted(levels):
+        if side >= longest:
+            break
+        label = f"{side}px"
+        attempts.append(label)
+        probs = decode_many([resize_max_side(img_bgr, side)])
+        if is_clean(probs):
+            return probs, {"level": label, "clean": True, "attempts": attempts}
+
+    if crops and longest > crop_size:
+        label = f"crop@{crop_size}px"
+        attempts.append(label)
+        probs = decode_many(crop_grid(img_bgr, crop_size, crops))
+        for i in range(probs.shape[0]):
+            if is_clean(probs[i:i + 1]):
+                return probs[i:i + 1], {"level": label, "clean": True, "attempts": attempts}
+        if probs.shape[0] > 1:
+            label = f"crops-vote@{crop_size}px"
+            attempts.append(label)
+            voted = probs.mean(dim=0, keepdim=True)
+            if is_clean(voted):
+                return voted, {"level": label, "clean": True, "attempts": attempts}
+
+    attempts.append("full")
+    probs = decode_many([img_bgr])
+    return probs, {"level": "full", "clean": bool(is_clean(probs)), "attempts": attempts}
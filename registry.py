@@ -0,0 +1,308 @@
+# registry.py
+"""Registry of issued fingerprints with nearest-Hamming-distance lookup.
+
+Every embedded payload is stored as packed bits in ``<path>`` (SQLite) and
+in an in-memory multi-index hash. Issued payloads are short metadata strings
+followed by zero padding, so only the informative prefix is indexed: bits
+that never vary (padding, ASCII high bits, separators) are left out, and the
+remaining bits are dealt round-robin, most variable first, into
+``chunk_bits``-wide substrings. Each substring is keyed by (position, value)
+in sorted numpy arrays searched with ``np.searchsorted``; new rows are kept
+in a few log-structured segments that are merged as they grow, and the
+newest few hundred rows are simply ranked directly. The database is opened
+and indexed on the first lookup or insert, not when the registry is
+constructed.
+
+A query probes every substring within ``chunk_radius`` bit flips, then ranks
+the candidates by exact Hamming distance over the prefix (bits past the
+longest issued payload add the same distance to every code). All-zero
+substrings are not indexed, and buckets larger than ``bucket_limit`` are
+skipped. A substring counts as covered only if every value within the radius
+was looked up; by pigeonhole, any issued code within (radius + 1) * covered
+- 1 bits of the query is then among the candidates. Exact substrings are
+tried first and the radius widens (up to ``chunk_radius``) while the best
+candidate is not within that bound. Past the widest radius the best
+candidate is returned as is, so matches further than the bound are
+best-effort. If no candidate survives, the query falls back to a vectorised
+scan of every code.
+
+``python bench.py run --suites registry`` measures lookups at 1M+ entries.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    metadata TEXT NOT NULL,
+    bits BLOB NOT NULL UNIQUE
+);
+"""
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+TAIL_ROWS = 512         # newest rows ranked directly until they become a segment
+LAYOUT_SAMPLE = 65536   # rows used to pick the indexed bits; re-picked as the registry doubles up to this
+_BLOCK = 65536          # rows per block when computing substring values
+
+
+def hamming_distances(codes, query):
+    """Hamming distance between each packed row of ``codes`` (N,B) and a packed (B,) query."""
+    diff = np.bitwise_xor(codes, query)
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        if diff.dtype == np.uint64 or diff.shape[1] % 8:
+            return np.bitwise_count(diff).sum(axis=1, dtype=np.int64)
+        return np.bitwise_count(diff.view(np.uint64)).sum(axis=1, dtype=np.int64)
+    if diff.dtype != np.uint8:
+        diff = diff.view(np.uint8)
+    return _POPCOUNT[diff].sum(axis=1)
+
+
+def _gather(rows, lo, hi):
+    """Concatenation of rows[lo[i]:hi[i]] for every i, without a Python loop."""
+    sizes = hi - lo
+    total = int(sizes.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.repeat(lo - (np.cumsum(sizes) - sizes), sizes)
+    return rows[starts + np.arange(total)]
+
+
+class FingerprintRegistry:
+    def __init__(self, path, payload_size=1024, chunk_bits=32, chunk_radius=1, bucket_limit=256):
+        if payload_size % 64 or chunk_bits % 8 or not 8 <= chunk_bits <= 48:
+            raise ValueError("payload_size must be a multiple of 64 and chunk_bits a multiple of 8 up to 48")
+        self.path = path
+        self.payload_size = payload_size
+        self.chunk_bits = chunk_bits
+        self.chunk_radius = chunk_radius
+        self.bucket_limit = bucket_limit
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._codes = np.zeros((1024, payload_size // 8), dtype=np.uint8)
+        self._ids = np.zeros(1024, dtype=np.int64)
+        self._n = 0
+        self._last_id = 0
+        self._db_state = None
+        self._extent = 0        # uint64 words up to the last nonzero byte of any code
+        # Index layout: _perm[c] lists the payload bits of substring c (see _relayout).
+        self._perm = np.zeros((0, chunk_bits), dtype=np.int64)
+        self._layout_n = 0
+        self._shifts = np.arange(chunk_bits // 8, dtype=np.uint64) * np.uint64(8)
+        # Sorted (keys, rows) segments covering rows [0, _indexed_n); newer rows are the tail.
+        self._segments = []
+        self._indexed_n = 0
+
+    def _db(self):
+        """One connection per thread (and per process, so forked workers reconnect)."""
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def __len__(self):
+        self.refresh()
+        return self._n
+
+    # --- Index ---
+    def _pack(self, bits):
+        bits = np.asarray(bits, dtype=np.uint8).reshape(-1)[:self.payload_size]
+        return np.packbits(bits)
+
+    def _chunk_values(self, packed_rows):
+        """(k,B) packed rows → (k,C) uint64 substring values under the current layout."""
+        out = np.empty((len(packed_rows), len(self._perm)), dtype=np.uint64)
+        if not len(self._perm):
+            return out
+        width = int(self._perm.max()) // 8 + 1
+        for start in range(0, len(packed_rows), _BLOCK):
+            bits = np.unpackbits(packed_rows[start:start + _BLOCK, :width], axis=1)
+            chunk_bytes = np.packbits(bits[:, self._perm], axis=-1).astype(np.uint64)
+            out[start:start + _BLOCK] = np.bitwise_or.reduce(chunk_bytes << self._shifts, axis=-1)
+        return out
+
+    def _segment(self, start, stop):
+        """Sorted (keys, rows) for rows [start, stop); a key is (substring position, value)."""
+        values = self._chunk_values(self._codes[start:stop])
+        positions = np.arange(values.shape[1], dtype=np.uint64) << np.uint64(self.chunk_bits)
+        nz = values != 0  # all-zero substrings are not indexed
+        keys = (positions[None, :] | values)[nz]
+        rows = np.broadcast_to(np.arange(start, stop)[:, None], values.shape)[nz]
+        order = np.argsort(keys, kind="stable")
+        return keys[order], rows[order]
+
+    def _relayout(self):
+        """Pick the indexed bits from a sample of the codes and rebuild every segment (lock held)."""
+        sample = np.unpackbits(self._codes[:min(self._n, LAYOUT_SAMPLE), :self._extent * 8], axis=1)
+        p = sample.mean(axis=0)
+        spread = np.minimum(p, 1 - p)
+        order = np.argsort(-spread, kind="stable")
+        order = order[spread[order] > 0]  # constant bits carry no information
+        n_chunks = len(order) // self.chunk_bits
+        # Deal the bits round-robin so every substring gets a share of the most variable ones.
+        self._perm = order[:n_chunks * self.chunk_bits].reshape(self.chunk_bits, n_chunks).T.copy()
+        self._layout_n = self._n
+        self._segments = [self._segment(0, self._n)]
+        self._indexed_n = self._n
+
+    def _index(self, ids, packed_rows):
+        """Append packed rows to the code matrix and fold full tails into the index (lock held)."""
+        k = len(ids)
+        if not k:
+            return
+        while self._n + k > len(self._codes):
+            self._codes = np.concatenate([self._codes, np.zeros_like(self._codes)])
+            self._ids = np.concatenate([self._ids, np.zeros_like(self._ids)])
+        rows = np.arange(self._n, self._n + k)
+        self._codes[rows] = packed_rows
+        self._ids[rows] = ids
+        self._n += k
+        self._last_id = max(self._last_id, int(ids[-1]))
+        used = np.flatnonzero(packed_rows.any(axis=0))
+        if len(used):
+            self._extent = max(self._extent, int(used[-1]) // 8 + 1)
+        if self._n - self._indexed_n < TAIL_ROWS:
+            return
+        if self._layout_n < LAYOUT_SAMPLE and self._n >= 2 * self._layout_n:
+            self._relayout()
+            return
+        self._segments.append(self._segment(self._indexed_n, self._n))
+        self._indexed_n = self._n
+        # Log-structured merge: keep each segment well over the size of the next.
+        while len(self._segments) > 1 and 4 * len(self._segments[-1][0]) >= len(self._segments[-2][0]):
+            (k1, r1), (k2, r2) = self._segments[-2:]
+            keys, rows = np.concatenate([k1, k2]), np.concatenate([r1, r2])
+            order = np.argsort(keys, kind="stable")  # two sorted runs: a near-linear merge
+            self._segments[-2:] = [(keys[order], rows[order])]
+
+    def _file_state(self):
+        state = []
+        for path in (self.path, self.path + "-wal"):
+            try:
+                st = os.stat(path)
+                state.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return state
+
+    def refresh(self):
+        """Index rows added to the database since the last call (e.g. by another worker)."""
+        state = self._file_state()
+        if state == self._db_state:
+            return 0  # nothing written since the last refresh: skip the query
+        self._db_state = state
+        rows = self._db().execute("SELECT id, bits FROM fingerprints WHERE id > ? ORDER BY id",
+                                  (self._last_id,)).fetchall()
+        if not rows:
+            return 0
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        packed = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.uint8).reshape(len(rows), -1)
+        with self._lock:
+            keep = ids > self._last_id
+            self._index(ids[keep], packed[keep])
+        return int(keep.sum())
+
+    # --- Insert ---
+    def add(self, bits, metadata):
+        """Register one (P,) 0/1 payload; returns its id (existing id if already issued)."""
+        return self.bulk_add([(bits, metadata)])[0]
+
+    def bulk_add(self, items):
+        """Register many (bits, metadata) pairs in one transaction; returns their ids."""
+        packed = [self._pack(bits) for bits, _ in items]
+        now = time.time()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT OR IGNORE INTO fingerprints (created, metadata, bits) VALUES (?, ?, ?)",
+                           [(now, meta, p.tobytes()) for p, (_, meta) in zip(packed, items)])
+            ids = [db.execute("SELECT id FROM fingerprints WHERE bits = ?", (p.tobytes(),)).fetchone()[0]
+                   for p in packed]
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        self.refresh()
+        return ids
+
+    # --- Lookup ---
+    def _candidates(self, query_values, radius):
+        """Rows sharing a substring within ``radius`` flips of the query, and the pigeonhole bound.
+
+        Rows may repeat; ranking does not need them unique.
+        """
+        flips = np.zeros(1, dtype=np.uint64)
+        if radius:
+            flips = np.concatenate([flips, np.uint64(1) << np.arange(self.chunk_bits, dtype=np.uint64)])
+        values = query_values[:, None] ^ flips[None, :]
+        positions = np.arange(len(values), dtype=np.uint64) << np.uint64(self.chunk_bits)
+        probes = (positions[:, None] | values).ravel()
+        bounds = [(np.searchsorted(keys, probes, side="left"), np.searchsorted(keys, probes, side="right"))
+                  for keys, _ in self._segments]
+        sizes = sum(hi - lo for lo, hi in bounds).reshape(values.shape)
+        probed = sizes <= self.bucket_limit
+        nonzero = values != 0  # all-zero values are not indexed
+        # Covered only if every value within the radius was looked up.
+        covered = int((probed & nonzero).all(axis=1).sum())
+        use = (probed & nonzero).ravel()
+        found = [_gather(rows, lo[use], hi[use]) for (lo, hi), (_, rows) in zip(bounds, self._segments)]
+        rows = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+        # Any code closer than this shares a covered substring within the radius.
+        return rows, (radius + 1) * covered
+
+    def nearest(self, bits, max_distance=None):
+        """Closest issued fingerprint to a (P,) 0/1 payload.
+
+        Probes exact substrings first and widens to ``chunk_radius`` flips
+        while the best candidate is not within the pigeonhole bound; beyond
+        the widest bound the result is the best candidate found. Returns
+        {"id", "metadata", "created", "distance"} or None when the registry is
+        empty or the best match is further than ``max_distance``.
+        """
+        self.refresh()
+        query = self._pack(bits)
+        with self._lock:
+            if not self._n:
+                return None
+            codes = self._codes.view(np.uint64)[:, :self._extent]
+            prefix = query.view(np.uint64)[:self._extent]
+            # Bits past every issued payload add the same distance to every code.
+            padding = int(_POPCOUNT[query[self._extent * 8:]].sum())
+            best = None
+
+            def rank(rows):
+                nonlocal best
+                if len(rows):
+                    dist = hamming_distances(codes[rows], prefix)
+                    i = int(np.argmin(dist))
+                    if best is None or dist[i] < best[1]:
+                        best = (int(rows[i]), int(dist[i]))
+
+            rank(np.arange(self._indexed_n, self._n))  # the unindexed tail
+            found = proven = False
+            if self._segments:
+                query_values = self._chunk_values(query[None])[0]
+                for radius in range(self.chunk_radius + 1):
+                    rows, bound = self._candidates(query_values, radius)
+                    rank(rows)
+                    found = found or len(rows) > 0
+                    if best is not None and best[1] < bound:
+                        proven = True
+                        break
+            if self._indexed_n and not (found or proven):
+                rank(np.arange(self._indexed_n))
+            row_id, distance = int(self._ids[best[0]]), best[1] + padding
+        if max_distance is not None and distance > max_distance:
+            return None
+        created, metadata = self._db().execute("SELECT created, metadata FROM fingerprints WHERE id = ?",
+                                               (row_id,)).fetchone()
+        return {"id": row_id, "metadata": metadata, "created": created, "distance": distance}
@@ -0,0 +1,299 @@
+# service.py
+"""Model loading, batching and metadata helpers shared by app.py and its workers.
+
+Importing this module starts no threads and loads no models: that happens on
+the first load_models()/warmup() call. Bulk-job workers, inference owners and
+the CLIs (video.py, offline.py) import this instead of the Flask app.
+"""
+import datetime
+import os
+import threading
+import time
+import traceback
+
+import numpy as np
+import torch
+
+import ecc
+import inference
+from backends import load_decoder_backend, load_weights
+from batching import MicroBatcher
+from fused import FusedDecoder, FusedEncoder, bgr_to_tensor, tensor_to_bgr
+from metrics import span
+from model import DecoderCNN, EncoderCNN
+from registry import FingerprintRegistry
+from tiling import TILE_OVERLAP, TILE_SIZE, encode_tiled
+
+CHECKPOINTS = "checkpoints"
+
+# --- Device handling ---
+if torch.cuda.is_available():
+    device = torch.device("cuda")
+elif torch.backends.mps.is_available():
+    device = torch.device("mps")
+else:
+    device = torch.device("cpu")
+
+# Globals for models (lazy-loaded)
+_encoder = None
+_decoder = None
+_decoder_cpu = None  # CPU fallback for MPS issues
+_fused_encoder = None  # BGR uint8 views of the models used by the HTTP path (see fused.py)
+_fused_decoder = None
+_embed_batcher = None
+_decode_batcher = None
+_load_lock = threading.Lock()
+_readiness = {"ready": False, "load_seconds": None, "warmup_seconds": None, "error": None}
+
+PAYLOAD_SIZE = 1024  # must match your training
+
+# PAYLOAD_ECC=1 Hamming(7,4)-codes embedded metadata (corrects one flipped bit
+# per 7) and lets progressive decode exit on clean syndromes. Images embedded
+# with one setting must be decoded with the same one.
+PAYLOAD_ECC = os.environ.get("PAYLOAD_ECC", "0") == "1"
+
+# Decoder backend: "float" (decoder.pth), an artifact from export_decoder.py
+# ("int8", "int8-static", "torchscript", "onnx"), or a variant name registered
+# in checkpoints/decoder_variants.json by distill_decoder.py. Non-float
+# backends run on CPU.
+DECODER_BACKEND = os.environ.get("DECODER_BACKEND", "float")
+
+# --- Fingerprint registry ---
+# Every issued payload is recorded; /api/decode reports the nearest issued
+# fingerprint by Hamming distance when it is within REGISTRY_MAX_DISTANCE bits.
+REGISTRY_PATH = os.environ.get("REGISTRY_PATH", os.path.join(".cache", "registry.db"))
+REGISTRY_MAX_DISTANCE = int(os.environ.get("REGISTRY_MAX_DISTANCE", "96"))
+registry = FingerprintRegistry(REGISTRY_PATH, payload_size=PAYLOAD_SIZE)  # opened on first use
+
+# --- Warmup ---
+WARMUP_SIZES = [int(s) for s in os.environ.get("WARMUP_SIZES", "256,512,1024").split(",") if s]
+
+# --- Inference server mode ---
+# With INFERENCE_SOCKETS (the socket directory of `python inference.py`, or
+# comma-separated socket paths) this process loads no models: decoded images
+# go to the model-owner processes through shared memory. The video endpoints
+# need local models and are refused in this mode.
+# Owners only listen once their own warmup is done, so readiness keeps pinging
+# them (backing off to INFERENCE_READY_MAX_DELAY seconds) until all answer.
+INFERENCE_SOCKETS = os.environ.get("INFERENCE_SOCKETS", "")
+INFERENCE_READY_MAX_DELAY = float(os.environ.get("INFERENCE_READY_MAX_DELAY", "10"))
+_inference = None
+
+# --- Batching settings ---
+# Requests arriving within MAX_BATCH_DELAY_MS are run as one forward pass of up
+# to MAX_BATCH_SIZE images. Encoder buckets pad H/W up to BATCH_PAD_MULTIPLE;
+# the decoder pools over the whole frame, so it only batches identical sizes.
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "8"))
+MAX_BATCH_DELAY_MS = float(os.environ.get("MAX_BATCH_DELAY_MS", "5"))
+BATCH_PAD_MULTIPLE = int(os.environ.get("BATCH_PAD_MULTIPLE", "32"))
+
+# --- Model loading ---
+def load_models():
+    """Load encoder/decoder checkpoints and prepare models."""
+    global _encoder, _decoder, _decoder_cpu, _fused_encoder, _fused_decoder, _embed_batcher, _decode_batcher
+
+    with _load_lock:
+        if _encoder is not None and _decoder is not None:
+            return
+
+        enc_path = os.path.join(CHECKPOINTS, "encoder.pth")
+        dec_path = os.path.join(CHECKPOINTS, "decoder.pth")
+
+        if not os.path.exists(enc_path) or not os.path.exists(dec_path):
+            raise FileNotFoundError("encoder.pth or decoder.pth not found in checkpoints/")
+
+        t0 = time.perf_counter()
+        # Weights are mmap'd: on CPU the parameters alias the checkpoint file's pages.
+        encoder = load_weights(EncoderCNN(), enc_path)
+        encoder.to(device).eval()
+
+        if DECODER_BACKEND == "float":
+            decoder = load_weights(DecoderCNN(payload_size=PAYLOAD_SIZE), dec_path)
+            if device.type == "mps":
+                _decoder_cpu = decoder.eval()
+                decoder = load_weights(DecoderCNN(payload_size=PAYLOAD_SIZE), dec_path)
+            decoder.to(device).eval()
+        else:
+            decoder = load_decoder_backend(DECODER_BACKEND, CHECKPOINTS, PAYLOAD_SIZE)
+            _decoder_cpu = decoder
+        _fused_encoder = FusedEncoder(encoder)
+        _fused_decoder = FusedDecoder(_decoder_cpu if _decoder_cpu is not None else decoder)
+
+        # The batchers carry BGR channels_last batches from the upload path.
+        if _embed_batcher is None:
+            _embed_batcher = MicroBatcher(run_fused_encoder_batch, MAX_BATCH_SIZE, MAX_BATCH_DELAY_MS,
+                                          pad_multiple=BATCH_PAD_MULTIPLE, name="embed-batcher")
+        if _decode_batcher is None:
+            _decode_batcher = MicroBatcher(run_fused_decoder_batch, MAX_BATCH_SIZE, MAX_BATCH_DELAY_MS,
+                                           pad_multiple=1, name="decode-batcher")
+
+        _encoder, _decoder = encoder, decoder
+        _readiness["load_seconds"] = time.perf_counter() - t0
+
+def embed_settings_key():
+    """Everything besides the image and payload that changes embed output: encoder weights, ECC, tiling."""
+    try:
+        st = os.stat(os.path.join(CHECKPOINTS, "encoder.pth"))
+        weights = f"{st.st_size}:{st.st_mtime_ns}"
+    except FileNotFoundError:
+        weights = "missing"
+    return f"{weights}|ecc={int(PAYLOAD_ECC)}|payload={PAYLOAD_SIZE}|tile={TILE_SIZE}/{TILE_OVERLAP}"
+
+def inference_client():
+    """This process's connection to the inference workers (rebuilt after a fork; dead owners reconnect on their own)."""
+    global _inference
+    if _inference is None or _inference[0] != os.getpid():
+        client = inference.InferenceClient(INFERENCE_SOCKETS)
+        _inference = (os.getpid(), client)
+    return _inference[1]
+
+def ensure_models():
+    if INFERENCE_SOCKETS:
+        return
+    if _encoder is None or _decoder is None:
+        with span("load_models"):
+            load_models()
+
+def warmup(local=False):
+    """Load models and run one forward per WARMUP_SIZES resolution, then mark ready.
+
+    local=True warms up this process's own models even when INFERENCE_SOCKETS is
+    set (the model owners themselves). Otherwise, in socket mode, this retries
+    until every owner answers a ping (so EAGER_LOAD=sync waits for them).
+    """
+    try:
+        if INFERENCE_SOCKETS and not local:
+            delay = 0.5
+            while True:
+                try:
+                    inference_client().ping()
+                    break
+                except (OSError, EOFError, RuntimeError) as e:  # owners still starting up
+                    _readiness["error"] = str(e)
+                    time.sleep(delay)
+                    delay = min(delay * 2, INFERENCE_READY_MAX_DELAY)
+            _readiness["error"] = None
+            _readiness["ready"] = True
+            return
+        load_models()
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            for size in WARMUP_SIZES:
+                img = bgr_to_tensor(np.zeros((size, size, 3), dtype=np.uint8), device)
+                payload = torch.zeros((1, PAYLOAD_SIZE), device=device)
+                if size > TILE_SIZE:
+                    encode_tiled(_fused_encoder.model, img.cpu(), payload)
+                else:
+                    run_fused_encoder_batch(img, payload)
+                run_fused_decoder_batch(img)
+        _readiness["warmup_seconds"] = time.perf_counter() - t0
+        _readiness["ready"] = True
+    except Exception as e:
+        traceback.print_exc()
+        _readiness["error"] = str(e)
+
+def run_encoder_batch(images, payloads):
+    """Encoder forward for a (B,3,H,W) batch and its (B,PAYLOAD_SIZE) payloads."""
+    return _encoder(images, payloads)
+
+def run_decoder_batch(images, _payloads=None):
+    """Decoder forward for a (B,3,H,W) batch, on CPU under MPS or for CPU-only backends."""
+    if _decoder_cpu is not None:
+        return _decoder_cpu(images.cpu())
+    return _decoder(images)
+
+def run_fused_encoder_batch(images, payloads):
+    """run_encoder_batch for BGR batches made by bgr_to_tensor."""
+    return _fused_encoder.model(images, payloads)
+
+def run_fused_decoder_batch(images, _payloads=None):
+    """run_decoder_batch for BGR batches made by bgr_to_tensor."""
+    if _decoder_cpu is not None:
+        images = images.cpu()
+    return _fused_decoder.decode_float(images)
+
+# --- Metadata helpers ---
+def encode_metadata_plain(username: str) -> bytes:
+    """Return raw bytes of 'username|YYYY-MM-DD HH:MM:SS'."""
+    dt = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    meta = f"{username}|{dt}"
+    return meta.encode("utf-8")
+
+def payload_bits(b: bytes):
+    """Metadata bytes → (1, PAYLOAD_SIZE) uint8 bits as embedded."""
+    return ecc.encode_payloads([b], PAYLOAD_SIZE, ecc=PAYLOAD_ECC)
+
+def bytes_to_payload_tensor(b: bytes, device_target):
+    """Convert metadata bytes → payload tensor (1, PAYLOAD_SIZE)."""
+    return torch.from_numpy(payload_bits(b)).float().to(device_target)
+
+def register_payload(meta_bytes):
+    """Record an issued payload in the fingerprint registry."""
+    registry.add(payload_bits(meta_bytes)[0], meta_bytes.decode("utf-8"))
+
+def registry_match(payload_pred):
+    """Nearest issued fingerprint to decoded probabilities, or None."""
+    match = registry.nearest(ecc.to_bits(payload_pred)[0], REGISTRY_MAX_DISTANCE)
+    if match is None:
+        return None
+    fingerprint, timestamp = split_metadata(match["metadata"])
+    return {"id": match["id"], "fingerprint": fingerprint, "timestamp": timestamp,
+            "distance": match["distance"]}
+
+def split_metadata(decoded_meta):
+    """'username|timestamp' → (fingerprint, timestamp)."""
+    if "|" in decoded_meta:
+        return tuple(decoded_meta.split("|", 1))
+    return decoded_meta, ""
+
+def payload_tensor_to_string(tensor):
+    """Convert decoder output tensor → UTF-8 metadata string."""
+    return ecc.decode_payloads(tensor.reshape(-1, PAYLOAD_SIZE), ecc=PAYLOAD_ECC)[0]
+
+def payload_is_clean(tensor):
+    """Early-exit test for progressive decode.
+
+    With PAYLOAD_ECC every Hamming syndrome must be zero first. Either way the
+    decoded text must pass the framing check (non-empty username and a
+    parseable timestamp), since the all-zero codeword also has clean syndromes.
+    """
+    if PAYLOAD_ECC and not ecc.syndromes_clean(tensor.reshape(-1, PAYLOAD_SIZE))[0]:
+        return False
+    fingerprint, timestamp = split_metadata(payload_tensor_to_string(tensor))
+    try:
+        datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return False
+    return bool(fingerprint)
+
+# --- Image helpers ---
+def watermark_image(img_bgr, payload):
+    """Watermark a BGR uint8 image; returns BGR uint8. Uploads larger than TILE_SIZE are encoded in tiles."""
+    h, w = img_bgr.shape[:2]
+    tiled = max(h, w) > TILE_SIZE
+    with span("to_tensor"):
+        img_tensor = bgr_to_tensor(img_bgr, torch.device("cpu") if tiled else device)
+    with span("forward"):  # includes the wait for the micro-batch
+        if tiled:
+            watermarked = encode_tiled(_fused_encoder.model, img_tensor, payload)
+        else:
+            watermarked = _embed_batcher(img_tensor, payload)
+    with span("to_uint8"):
+        return tensor_to_bgr(watermarked)[0]
+
+def embed_bgr_image(img_bgr, meta_bytes):
+    """Watermarked BGR uint8 image for the metadata, computed here or on an inference worker."""
+    if INFERENCE_SOCKETS:
+        with span("forward"):
+            return inference_client().embed(img_bgr, payload_bits(meta_bytes)[0])
+    with span("payload_encode"):
+        payload = bytes_to_payload_tensor(meta_bytes, device)
+    return watermark_image(img_bgr, payload)
+
+def decode_bgr_images(images):
+    """Decode a list of BGR uint8 arrays through the decode batcher; returns (N,PAYLOAD_SIZE)."""
+    if INFERENCE_SOCKETS:
+        client = inference_client()
+        return torch.from_numpy(np.stack([client.decode(img, PAYLOAD_SIZE) for img in images]))
+    futures = [_decode_batcher.submit(bgr_to_tensor(img, device)) for img in images]
+    return torch.cat([f.result() for f in futures], dim=0)
@@ -0,0 +1,203 @@
+"""Hyperparameter sweep over the train.py objective.
+
+Every combination of the listed values (or a random --samples subset of
+them) is trained for a few short epochs in a spawn-based process pool. Each
+trial is capped at --threads torch threads, so --workers trials share the
+machine without oversubscribing it.
+
+    python sweep.py --lambda-payload 1 5 10 --lr 1e-4 3e-4 --residual-scale 0.05 0.1
+    python sweep.py --batch-size 4 8 16 --samples 6 --workers 3 --threads 4
+
+After --grace epochs, trials stop early when their image MSE breaks the
+--min-psnr budget, or when their bit accuracy is below the median of the other
+in-budget trials at the same epoch. Finished trials are appended to
+results/sweep_<id>/trials.jsonl, and rerunning the same command skips them.
+leaderboard.json ranks in-budget trials by bit accuracy, then by image MSE.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import torch
+
+from dataset import ImageDataset
+from train import CACHE_DIR, build_loader, train
+
+RESULTS_DIR = "results"
+PARAMS = ("lambda_payload", "lr", "residual_scale", "batch_size")
+
+
+def psnr_from_mse(mse):
+    return float("inf") if mse <= 0 else 10 * math.log10(1.0 / mse)
+
+
+def trial_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def search_space(args):
+    """Trial parameter dicts, in a reproducible order."""
+    grid = [dict(zip(PARAMS, values)) for values in
+            itertools.product(args.lambda_payload, args.lr, args.residual_scale, args.batch_size)]
+    if args.samples and args.samples < len(grid):
+        grid = random.Random(args.seed).sample(grid, args.samples)
+    return grid
+
+
+# --- Early stopping ---
+def should_stop(history, key, epoch, metrics, max_mse, grace):
+    """Record a trial's epoch metrics in the shared history; returns a stop reason or None."""
+    history[key, epoch] = metrics
+    if epoch + 1 < grace:
+        return None
+    if metrics["image_mse"] > max_mse:
+        return "image_mse"
+    peers = [m["bit_accuracy"] for (k, e), m in list(history.items())
+             if e == epoch and k != key and m["image_mse"] <= max_mse]
+    if len(peers) >= 2 and metrics["bit_accuracy"] < statistics.median(peers):
+        return "bit_accuracy"
+    return None
+
+
+# --- Worker process ---
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+
+def run_trial(params, args, history):
+    """Train one configuration; returns its leaderboard row."""
+    torch.manual_seed(args.seed)
+    key = trial_key(params)
+    loader = build_loader(args.data, batch_size=params["batch_size"], num_workers=0,
+                          cache_dir=None if args.no_cache else CACHE_DIR)
+    max_mse = 10 ** (-args.min_psnr / 10)
+    last = {}
+    stopped = []
+
+    def on_epoch_end(epoch, metrics):
+        last.update(metrics, epochs=epoch + 1)
+        reason = should_stop(history, key, epoch, metrics, max_mse, args.grace)
+        if reason:
+            stopped.append(reason)
+        return reason is not None
+
+    t0 = time.perf_counter()
+    train(loader, torch.device("cpu"), epochs=args.epochs, lr=params["lr"],
+          lambda_payload=params["lambda_payload"], residual_scale=params["residual_scale"],
+          log_every=10**9, checkpoint_dir=None, max_batches=args.steps, on_epoch_end=on_epoch_end)
+    return {
+        "params": params,
+        "epochs": last.get("epochs", 0),
+        "bit_accuracy": last.get("bit_accuracy"),
+        "image_mse": last.get("image_mse"),
+        "psnr": psnr_from_mse(last["image_mse"]) if "image_mse" in last else None,
+        "loss": last.get("loss"),
+        "in_budget": last.get("image_mse", math.inf) <= max_mse,
+        "stopped": stopped[0] if stopped else None,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# --- Run bookkeeping ---
+def sweep_id(args, trials):
+    stamp = [os.path.abspath(args.data), args.epochs, args.steps, args.min_psnr, args.grace, args.seed,
+             sorted(trial_key(t) for t in trials)]
+    return hashlib.blake2b(json.dumps(stamp).encode(), digest_size=6).hexdigest()
+
+
+def read_trials(path):
+    rows = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # partial line from an interrupted write
+                rows[trial_key(row["params"])] = row
+    return rows
+
+
+def leaderboard(rows):
+    """In-budget trials first, then by bit accuracy (desc) and image MSE (asc)."""
+    return sorted(rows, key=lambda r: (not r["in_budget"], -(r["bit_accuracy"] or 0), r["image_mse"] or math.inf))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="datasets/train")
+    # --- Search space ---
+    parser.add_argument("--lambda-payload", type=float, nargs="+", default=[1.0, 5.0, 10.0])
+    parser.add_argument("--lr", type=float, nargs="+", default=[1e-4, 3e-4])
+    parser.add_argument("--residual-scale", type=float, nargs="+", default=[0.05, 0.1])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[4])
+    parser.add_argument("--samples", type=int, default=0, help="random subset of the grid (0 = all)")
+    # --- Trial budget ---
+    parser.add_argument("--epochs", type=int, default=5, help="short epochs per trial")
+    parser.add_argument("--steps", type=int, default=100, help="batches per short epoch")
+    parser.add_argument("--min-psnr", type=float, default=35.0, help="imperceptibility budget in dB")
+    parser.add_argument("--grace", type=int, default=2, help="epochs before a trial can be stopped")
+    # --- Resources ---
+    parser.add_argument("--workers", type=int, default=4, help="concurrent trials")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per trial (default: cores / workers)")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    trials = search_space(args)
+    workers = max(1, min(args.workers, len(trials)))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    if not args.no_cache:
+        ImageDataset(args.data, cache_dir=CACHE_DIR)  # build the shared image cache once, before the trials map it
+
+    run_dir = os.path.join(RESULTS_DIR, f"sweep_{sweep_id(args, trials)}")
+    os.makedirs(run_dir, exist_ok=True)
+    trials_path = os.path.join(run_dir, "trials.jsonl")
+    done = read_trials(trials_path)
+    todo = [t for t in trials if trial_key(t) not in done]
+    print(f"{len(trials)} trials, {len(done)} already run, {workers} at a time x {threads} threads → {run_dir}")
+
+    if todo:
+        # Children inherit the cap before torch initialises its thread pools.
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[var] = str(threads)
+        ctx = mp.get_context("spawn")
+        with ctx.Manager() as manager, open(trials_path, "a") as out:
+            history = manager.dict()
+            with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker, initargs=(threads,)) as pool:
+                futures = [pool.submit(run_trial, t, args, history) for t in todo]
+                for fut in as_completed(futures):
+                    row = fut.result()
+                    done[trial_key(row["params"])] = row
+                    out.write(json.dumps(row) + "\n")
+                    out.flush()
+                    status = f"stopped ({row['stopped']})" if row["stopped"] else "done"
+                    print(f"{row['params']}: {status} after {row['epochs']} epochs, "
+                          f"bit acc {row['bit_accuracy'] or 0:.4f}, psnr {row['psnr'] or 0:.2f} dB")
+
+    board = leaderboard(list(done.values()))
+    with open(os.path.join(run_dir, "leaderboard.json"), "w") as f:
+        json.dump({"config": vars(args), "trials": board}, f, indent=2)
+    print(f"{'#':>3s} {'lambda':>7s} {'lr':>8s} {'scale':>6s} {'batch':>5s} {'bit acc':>8s} {'psnr':>7s}  status")
+    for rank, r in enumerate(board, 1):
+        p = r["params"]
+        status = "over budget" if not r["in_budget"] else (f"stopped ({r['stopped']})" if r["stopped"] else "done")
+        print(f"{rank:3d} {p['lambda_payload']:7.2f} {p['lr']:8.1e} {p['residual_scale']:6.3f} {p['batch_size']:5d} "
+              f"{(r['bit_accuracy'] or 0) * 100:7.2f}% {r['psnr'] or 0:7.2f}  {status}")
+    print(f"Wrote {os.path.join(run_dir, 'leaderboard.json')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# tiling.py
+import os
+
+import torch
+
+# Peak activation memory is bounded by TILE_SIZE^2 * 64 channels * TILE_BATCH_SIZE
+# instead of growing with the upload resolution.
+TILE_SIZE = int(os.environ.get("TILE_SIZE", "1024"))
+TILE_OVERLAP = int(os.environ.get("TILE_OVERLAP", "32"))
+TILE_BATCH_SIZE = int(os.environ.get("TILE_BATCH_SIZE", "4"))
+
+
+def _tile_starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def _blend_window(th, tw, overlap):
+    """Weights that ramp up linearly across the overlap band of a tile."""
+    def ramp(n):
+        r = torch.arange(n, dtype=torch.float32)
+        r = torch.minimum(r + 1, n - r)
+        return (r / max(overlap, 1)).clamp(max=1.0)
+    return ramp(th)[:, None] * ramp(tw)[None, :]
+
+
+def encode_tiled(encoder, image, payload, tile_size=None, overlap=None, batch_size=None):
+    """Run the encoder over overlapping tiles and blend them at native resolution.
+
+    ``image`` is a (1,3,H,W) float tensor (it can stay on CPU); tiles are moved
+    to ``payload.device`` batch by batch. Returns a (1,3,H,W) CPU tensor.
+    """
+    tile_size = tile_size or TILE_SIZE
+    overlap = TILE_OVERLAP if overlap is None else overlap
+    batch_size = batch_size or TILE_BATCH_SIZE
+    target = payload.device
+
+    _, c, h, w = image.shape
+    if h <= tile_size and w <= tile_size:
+        with torch.no_grad():
+            return encoder(image.to(target), payload).float().cpu()
+
+    th, tw = min(tile_size, h), min(tile_size, w)
+    overlap = min(overlap, th - 1, tw - 1)
+    coords = [(y, x)
+              for y in _tile_starts(h, th, th - overlap)
+              for x in _tile_starts(w, tw, tw - overlap)]
+
+    window = _blend_window(th, tw, overlap)
+    out = torch.zeros((c, h, w), dtype=torch.float32)
+    weight = torch.zeros((h, w), dtype=torch.float32)
+
+    for i in range(0, len(coords), batch_size):
+        chunk = coords[i:i + batch_size]
+        tiles = torch.cat([image[..., y:y + th, x:x + tw] for y, x in chunk], dim=0).to(target)
+        with torch.no_grad():
+            res = encoder(tiles, payload.expand(len(chunk), -1)).float().cpu()
+        for (y, x), r in zip(chunk, res):
+            out[:, y:y + th, x:x + tw] += r * window
+            weight[y:y + th, x:x + tw] += window
+
+    out /= weight
+    return out.unsqueeze(0)
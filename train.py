@@ -1,64 +1,382 @@
+import argparse
+import glob
+import random
+import time
+import numpy as np
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
-from dataset import ImageDataset
+from torch.utils.data.distributed import DistributedSampler
+from dataset import ImageDataset, PayloadCollate, images_to_float, make_payload_bank
 from model import EncoderCNN, DecoderCNN
 import torch.nn as nn
 import torch.optim as optim
 import os
 
 CHECKPOINTS = 'checkpoints'
-os.makedirs(CHECKPOINTS, exist_ok=True)
+CACHE_DIR = os.path.join('datasets', '.cache')  # resized uint8 images, rebuilt when sources change
+PAYLOAD_BANK_SIZE = 4096
+PAYLOAD_SEED = 0
+EPOCHS = 50
+STEP_CHECKPOINTS = os.path.join(CHECKPOINTS, 'steps')         # periodic training state, resumed automatically
+FINETUNE_CHECKPOINTS = os.path.join(CHECKPOINTS, 'finetune')  # same, for --finetune runs
+CHECKPOINT_EVERY = 500  # optimizer steps
+KEEP_LAST = 3
 
-device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
-print("Using device:", device)
 
-train_dataset = ImageDataset('datasets/train')
-train_loader = DataLoader(train_dataset, batch_size=4, shuffle=True)
+class WatermarkPair(nn.Module):
+    """Encoder + decoder as one module so DDP all-reduces both in a single pass."""
 
-encoder = EncoderCNN().to(device)
-decoder = DecoderCNN().to(device)
-encoder.train()
-decoder.train()
+    def __init__(self, residual_scale=0.1):
+        super().__init__()
+        self.encoder = EncoderCNN(residual_scale=residual_scale)
+        self.decoder = DecoderCNN()
 
-bce_loss = nn.BCELoss()
-mse_loss = nn.MSELoss()
-lambda_payload = 5.0
+    def forward(self, imgs, payloads):
+        watermarked = self.encoder(imgs, payloads)
+        return watermarked, self.decoder(watermarked)
 
-optimizer = optim.Adam(list(encoder.parameters()) + list(decoder.parameters()), lr=1e-4)
 
-EPOCHS = 50
-for epoch in range(EPOCHS):
-    total_loss = 0
-    total_correct_bits = 0   # <-- initialize here
-    total_bits = 0  
-    for i, (imgs, payloads) in enumerate(train_loader):
-        imgs = imgs.to(device).float()
-        payloads = payloads.to(device).float()
-        optimizer.zero_grad()
-
-        watermarked = encoder(imgs, payloads)
-        decoded = decoder(watermarked)
-
-        payload_loss = bce_loss(decoded, payloads)
-        image_loss = mse_loss(watermarked, imgs)
-        loss = image_loss + lambda_payload * payload_loss
-
-        loss.backward()
-        optimizer.step()
-
-        total_loss += loss.item()
-        # --- Accuracy calculation ---
-        pred_bits = (decoded > 0.5).float()       # threshold at 0.5
-        total_correct_bits += (pred_bits == payloads).sum().item()
-        total_bits += payloads.numel()  
-        if i % 5 == 0:
-            print(f"[BATCH {i}] payload_loss={payload_loss.item():.4f}, "
-                  f"image_loss={image_loss.item():.4f}, total={loss.item():.4f}")
-
-    avg_loss = total_loss / len(train_loader)
-    accuracy = total_correct_bits / total_bits * 100
-    print(f"Epoch [{epoch+1}/{EPOCHS}], Avg Loss: {avg_loss:.4f}, Payload Accuracy: {accuracy:.2f}%")
-
-torch.save(encoder.state_dict(), os.path.join(CHECKPOINTS, 'encoder.pth'))
-torch.save(decoder.state_dict(), os.path.join(CHECKPOINTS, 'decoder.pth'))
-print("✅ Training complete.")
+class ResumableSampler(DistributedSampler):
+    """Seeded per-epoch shuffle (sharded by rank) that can skip the batches already trained on.
+
+    Also used with a single process (num_replicas=1), so a resumed epoch
+    replays the same order without loading the skipped images.
+    """
+
+    def __init__(self, dataset, num_replicas=1, rank=0, seed=0):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed)
+        self.skip = 0
+
+    def __iter__(self):
+        return iter(list(super().__iter__())[self.skip:])
+
+    def __len__(self):
+        return max(0, super().__len__() - self.skip)
+
+
+# --- Checkpoints ---
+def atomic_save(obj, path):
+    """torch.save through a temporary file so a crash never leaves a truncated checkpoint."""
+    torch.save(obj, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def rng_state():
+    state = {"torch": torch.get_rng_state(), "numpy": np.random.get_state(), "python": random.getstate()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def list_checkpoints(checkpoint_dir):
+    """Step checkpoints in checkpoint_dir, oldest first."""
+    return sorted(glob.glob(os.path.join(checkpoint_dir, "step-*.pt")))
+
+
+def save_checkpoint(checkpoint_dir, pair, optimizer, epoch, batch, step, keep_last=KEEP_LAST,
+                    rank=0, world_size=1, config=None):
+    """Write step-<step>.pt (weights, optimizer, RNG of every rank) and drop all but the newest keep_last.
+
+    ``epoch``/``batch`` is the position to resume from; ``config`` holds the
+    run settings a resume must match. Collective when world_size > 1: every
+    rank must call it; only rank 0 writes.
+    """
+    rng = [rng_state()]
+    if world_size > 1:
+        rng = [None] * world_size
+        dist.all_gather_object(rng, rng_state())
+    if rank != 0:
+        return
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    atomic_save({
+        "model": pair.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "epoch": epoch,
+        "batch": batch,
+        "step": step,
+        "rng": rng,
+        "config": config,
+    }, os.path.join(checkpoint_dir, f"step-{step:08d}.pt"))
+    for old in list_checkpoints(checkpoint_dir)[:-keep_last]:
+        os.remove(old)
+
+
+def load_checkpoint(path, pair, optimizer, rank=0, config=None):
+    """Restore weights, optimizer and this rank's RNG; returns (epoch, batch, step) to resume from.
+
+    Raises ValueError if the checkpoint was written with a different ``config``.
+    """
+    ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    stored = ckpt.get("config")
+    if config is not None and stored is not None and stored != config:
+        changed = ", ".join(f"{k}={stored.get(k)!r}→{v!r}" for k, v in config.items() if stored.get(k) != v)
+        raise ValueError(f"{path} was written by a run with different settings ({changed}); "
+                         "pass --no-resume or another --checkpoint-dir to start a new run")
+    pair.load_state_dict(ckpt["model"])
+    optimizer.load_state_dict(ckpt["optimizer"])
+    rng = ckpt["rng"]
+    set_rng_state(rng[rank] if rank < len(rng) else rng[0])
+    return ckpt["epoch"], ckpt["batch"], ckpt["step"]
+
+
+def build_loader(root_dir, batch_size=4, num_workers=0, prefetch_factor=2,
+                 persistent_workers=True, pin_memory=False, cache_dir=CACHE_DIR,
+                 rank=0, world_size=1, local_rank=0):
+    """Training DataLoader: cached images, payload bank and batch-level collate.
+
+    With world_size > 1 each rank reads its own shard through a DistributedSampler.
+    """
+    distributed = world_size > 1
+    # Local rank 0 builds the image cache; the other local ranks then just map it.
+    if distributed and local_rank != 0:
+        dist.barrier()
+    payload_bank = make_payload_bank(PAYLOAD_BANK_SIZE, seed=PAYLOAD_SEED)
+    dataset = ImageDataset(root_dir, cache_dir=cache_dir, payload_bank=payload_bank)
+    if distributed and local_rank == 0:
+        dist.barrier()
+
+    sampler = ResumableSampler(dataset, num_replicas=world_size, rank=rank)
+    worker_kwargs = {}
+    if num_workers > 0:
+        worker_kwargs = {"prefetch_factor": prefetch_factor, "persistent_workers": persistent_workers}
+    return DataLoader(dataset, batch_size=batch_size, sampler=sampler,
+                      num_workers=num_workers, pin_memory=pin_memory, collate_fn=PayloadCollate(),
+                      **worker_kwargs)
+
+
+def train(train_loader, device, epochs=EPOCHS, lr=1e-4, lambda_payload=5.0, log_every=5,
+          rank=0, world_size=1, checkpoint_dir=None, checkpoint_every=CHECKPOINT_EVERY,
+          keep_last=KEEP_LAST, resume=True, init_from=None, residual_scale=0.1, max_batches=None,
+          on_epoch_end=None):
+    """Jointly optimise encoder and decoder; returns the trained (encoder, decoder).
+
+    With world_size > 1 (process group already initialised) gradients are
+    all-reduced through DDP and the epoch metrics are summed across ranks.
+    With checkpoint_dir set, the training state is saved every
+    checkpoint_every steps and at each epoch end, and (if resume) training
+    continues from the newest checkpoint there; that raises instead if the
+    checkpoint was written with other settings or already finished all
+    ``epochs``. Every rank reads the checkpoint, so multi-host runs need
+    checkpoint_dir on a filesystem shared by all hosts. init_from is a directory with
+    encoder.pth/decoder.pth to start from instead of random weights.
+    max_batches caps the batches per epoch (short sweep trials); on_epoch_end
+    is called as on_epoch_end(epoch, metrics) and stops training when it
+    returns True.
+    """
+    pair = WatermarkPair(residual_scale)
+    if init_from:
+        pair.encoder.load_state_dict(torch.load(os.path.join(init_from, 'encoder.pth'), map_location="cpu"))
+        pair.decoder.load_state_dict(torch.load(os.path.join(init_from, 'decoder.pth'), map_location="cpu"))
+        pair.encoder.residual_scale.fill_(residual_scale)  # this run's value, not the stored one
+    pair = pair.to(device)
+    pair.train()
+    is_main = rank == 0
+
+    bce_loss = nn.BCELoss()
+    mse_loss = nn.MSELoss()
+
+    optimizer = optim.Adam(pair.parameters(), lr=lr)
+
+    start_epoch, start_batch, step = 0, 0, 0
+    # Settings a resumed run must share with the one that wrote the checkpoint.
+    config = {"lr": lr, "lambda_payload": lambda_payload, "residual_scale": residual_scale,
+              "batch_size": train_loader.batch_size, "world_size": world_size}
+    existing = list_checkpoints(checkpoint_dir) if checkpoint_dir and resume else []
+    if world_size > 1:
+        latest = [None] * world_size
+        dist.all_gather_object(latest, os.path.basename(existing[-1]) if existing else None)
+        if len(set(latest)) > 1:
+            raise RuntimeError(f"ranks see different checkpoints in {checkpoint_dir} ({latest}); "
+                               "with --nnodes > 1 it must be on a filesystem shared by all hosts")
+    if existing:
+        start_epoch, start_batch, step = load_checkpoint(existing[-1], pair, optimizer, rank, config)
+        if start_epoch >= epochs:
+            raise RuntimeError(f"{existing[-1]} already finished {start_epoch} epochs; pass a larger --epochs "
+                               "to continue, or --no-resume / another --checkpoint-dir to train again")
+        if is_main:
+            print(f"Resuming from {existing[-1]} (epoch {start_epoch + 1}, batch {start_batch}, step {step})")
+    # Wrap after loading so DDP broadcasts the restored weights from rank 0.
+    model = DistributedDataParallel(pair) if world_size > 1 else pair
+
+    def checkpoint(epoch, batch):
+        if checkpoint_dir:
+            save_checkpoint(checkpoint_dir, pair, optimizer, epoch, batch, step, keep_last, rank, world_size,
+                            config)
+
+    for epoch in range(start_epoch, epochs):
+        train_loader.sampler.set_epoch(epoch)
+        train_loader.sampler.skip = start_batch * train_loader.batch_size if epoch == start_epoch else 0
+        first_batch = start_batch if epoch == start_epoch else 0
+        total_loss = 0
+        total_image_loss = 0
+        total_correct_bits = 0
+        total_bits = 0
+        data_time = 0.0     # waiting on the DataLoader
+        compute_time = 0.0  # forward/backward/step
+        t_ready = time.perf_counter()
+        for i, (imgs, payloads) in enumerate(train_loader, start=first_batch):
+            t_batch = time.perf_counter()
+            step_wait = t_batch - t_ready
+            data_time += step_wait
+
+            imgs = images_to_float(imgs.to(device, non_blocking=True))
+            payloads = payloads.to(device, non_blocking=True).float()
+            optimizer.zero_grad()
+
+            watermarked, decoded = model(imgs, payloads)
+
+            payload_loss = bce_loss(decoded, payloads)
+            image_loss = mse_loss(watermarked, imgs)
+            loss = image_loss + lambda_payload * payload_loss
+
+            loss.backward()
+            optimizer.step()
+            step += 1
+
+            total_loss += loss.item()
+            total_image_loss += image_loss.item()
+            # --- Accuracy calculation ---
+            pred_bits = (decoded > 0.5).float()       # threshold at 0.5
+            total_correct_bits += (pred_bits == payloads).sum().item()
+            total_bits += payloads.numel()
+
+            t_ready = time.perf_counter()
+            compute_time += t_ready - t_batch
+            if is_main and i % log_every == 0:
+                print(f"[BATCH {i}] payload_loss={payload_loss.item():.4f}, "
+                      f"image_loss={image_loss.item():.4f}, total={loss.item():.4f}, "
+                      f"data_wait={step_wait*1000:.1f}ms, compute={(t_ready - t_batch)*1000:.1f}ms")
+            if checkpoint_every and step % checkpoint_every == 0:
+                checkpoint(epoch, i + 1)
+                t_ready = time.perf_counter()  # don't count the save as data wait
+            if max_batches and i + 1 - first_batch >= max_batches:
+                break
+
+        n_batches = min(len(train_loader), max_batches or len(train_loader))
+        stats = torch.tensor([total_loss, total_image_loss, n_batches, total_correct_bits, total_bits,
+                              data_time, compute_time], dtype=torch.float64)
+        if world_size > 1:
+            dist.all_reduce(stats)
+            stats[5:] /= world_size  # report mean per-rank timings
+        (total_loss, total_image_loss, n_batches, total_correct_bits, total_bits,
+         data_time, compute_time) = stats.tolist()
+
+        avg_loss = total_loss / max(n_batches, 1)  # a resumed epoch may have no batches left
+        image_mse = total_image_loss / max(n_batches, 1)
+        accuracy = total_correct_bits / max(total_bits, 1) * 100
+        wait_share = data_time / max(data_time + compute_time, 1e-9) * 100
+        if is_main:
+            print(f"Epoch [{epoch+1}/{epochs}], Avg Loss: {avg_loss:.4f}, Payload Accuracy: {accuracy:.2f}%, "
+                  f"data wait: {data_time:.2f}s, compute: {compute_time:.2f}s ({wait_share:.1f}% waiting)")
+        checkpoint(epoch + 1, 0)
+        if on_epoch_end and on_epoch_end(epoch, {"loss": avg_loss, "image_mse": image_mse,
+                                                 "bit_accuracy": accuracy / 100}):
+            break
+
+    return pair.encoder, pair.decoder
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the watermark encoder/decoder.")
+    parser.add_argument("--data", default="datasets/train")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="DataLoader worker processes (0 = load in the training process)")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches prefetched per worker")
+    parser.add_argument("--no-persistent-workers", action="store_true")
+    parser.add_argument("--no-cache", action="store_true", help="decode JPEGs every epoch instead of the memmap cache")
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--lambda-payload", type=float, default=5.0, help="payload loss weight against image MSE")
+    parser.add_argument("--residual-scale", type=float, default=0.1,
+                        help="encoder residual scale (saved in encoder.pth)")
+    # --- Checkpointing ---
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help=f"step checkpoints (default: {STEP_CHECKPOINTS}, or {FINETUNE_CHECKPOINTS} with --finetune); "
+                             "must be on a shared filesystem with --nnodes > 1")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="optimizer steps between checkpoints (0 = only at epoch ends)")
+    parser.add_argument("--keep-last", type=int, default=KEEP_LAST, help="step checkpoints to keep")
+    parser.add_argument("--no-resume", action="store_true", help="ignore existing step checkpoints")
+    parser.add_argument("--finetune", action="store_true",
+                        help=f"start from {CHECKPOINTS}/encoder.pth and decoder.pth instead of random weights")
+    # --- Distributed (CPU / gloo) ---
+    parser.add_argument("--nproc", type=int, default=1, help="training processes per host")
+    parser.add_argument("--nnodes", type=int, default=1)
+    parser.add_argument("--node-rank", type=int, default=0)
+    parser.add_argument("--master-addr", default="127.0.0.1")
+    parser.add_argument("--master-port", default="29500")
+    return parser.parse_args()
+
+
+def run(local_rank, args):
+    """Per-process entry point; also used directly when launched by torchrun."""
+    if "RANK" in os.environ and "WORLD_SIZE" in os.environ:
+        rank = int(os.environ["RANK"])
+        world_size = int(os.environ["WORLD_SIZE"])
+        local_rank = int(os.environ.get("LOCAL_RANK", local_rank))
+        local_world = int(os.environ.get("LOCAL_WORLD_SIZE", args.nproc))
+    else:
+        rank = args.node_rank * args.nproc + local_rank
+        world_size = args.nnodes * args.nproc
+        local_world = args.nproc
+
+    distributed = world_size > 1
+    if distributed:
+        os.environ.setdefault("MASTER_ADDR", args.master_addr)
+        os.environ.setdefault("MASTER_PORT", str(args.master_port))
+        dist.init_process_group("gloo", rank=rank, world_size=world_size)
+        # Split the host's cores between the local ranks instead of oversubscribing.
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world))
+        device = torch.device("cpu")
+    else:
+        device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+
+    if rank == 0:
+        os.makedirs(CHECKPOINTS, exist_ok=True)
+        print("Using device:", device, f"(world size {world_size})" if distributed else "")
+
+    train_loader = build_loader(args.data, batch_size=args.batch_size, num_workers=args.workers,
+                                prefetch_factor=args.prefetch,
+                                persistent_workers=not args.no_persistent_workers,
+                                pin_memory=device.type == "cuda",
+                                cache_dir=None if args.no_cache else CACHE_DIR,
+                                rank=rank, world_size=world_size, local_rank=local_rank)
+
+    checkpoint_dir = args.checkpoint_dir or (FINETUNE_CHECKPOINTS if args.finetune else STEP_CHECKPOINTS)
+    encoder, decoder = train(train_loader, device, epochs=args.epochs, lr=args.lr,
+                             lambda_payload=args.lambda_payload, residual_scale=args.residual_scale, rank=rank,
+                             world_size=world_size, checkpoint_dir=checkpoint_dir,
+                             checkpoint_every=args.checkpoint_every, keep_last=args.keep_last,
+                             resume=not args.no_resume, init_from=CHECKPOINTS if args.finetune else None)
+
+    if rank == 0:
+        atomic_save(encoder.state_dict(), os.path.join(CHECKPOINTS, 'encoder.pth'))
+        atomic_save(decoder.state_dict(), os.path.join(CHECKPOINTS, 'decoder.pth'))
+        print("✅ Training complete.")
+
+    if distributed:
+        dist.destroy_process_group()
+
+
+def main():
+    args = parse_args()
+    if args.nproc > 1 and "RANK" not in os.environ:
+        mp.spawn(run, args=(args,), nprocs=args.nproc)
+    else:
+        run(0, args)
+
+
+if __name__ == "__main__":
+    main()
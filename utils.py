@@ -0,0 +1,95 @@
+# utils.py
+import os
+import uuid
+
+import cv2
+import numpy as np
+
+from metrics import span
+
+# format -> (mimetype, extension)
+IMAGE_FORMATS = {
+    "png": ("image/png", ".png"),
+    "jpeg": ("image/jpeg", ".jpg"),
+}
+
+
+# --- In-memory image I/O ---
+def decode_image_bytes(data, bgr=False):
+    """Decode an uploaded image buffer to an RGB (or, with bgr=True, OpenCV's BGR) uint8 array."""
+    with span("imdecode"):
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Failed to read image")
+    if bgr:
+        return img
+    with span("cvtColor"):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def encode_image(img_rgb, fmt="png", quality=None, bgr=False):
+    """Encode an RGB (or, with bgr=True, BGR) uint8 array; returns (bytes, mimetype).
+
+    ``quality`` is the JPEG quality (1-100, default 95) or the PNG compression
+    level (0-9, default 3).
+    """
+    mimetype, ext = IMAGE_FORMATS[fmt]
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(np.clip(95 if quality is None else quality, 1, 100))]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(np.clip(3 if quality is None else quality, 0, 9))]
+    with span("imencode"):
+        ok, buf = cv2.imencode(ext, img_rgb if bgr else cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"Failed to encode image as {fmt}")
+    return buf.tobytes(), mimetype
+
+
+def negotiate_format(req, default="png"):
+    """Output (format, quality) from the 'format'/'quality' fields, else the Accept header."""
+    fmt = (req.values.get("format") or "").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in IMAGE_FORMATS:
+        best = req.accept_mimetypes.best_match(["image/png", "image/jpeg"])
+        fmt = "jpeg" if best == "image/jpeg" else default
+    return fmt, req.values.get("quality", type=int)
+
+
+def wants_image_response(req):
+    """True if the client asked for the image itself rather than a JSON body."""
+    if req.values.get("response") == "image":
+        return True
+    best = req.accept_mimetypes.best_match(["application/json", "image/png", "image/jpeg"])
+    return best is not None and best.startswith("image/")
+
+
+# --- Opt-in on-disk persistence ---
+def save_unique(folder, filename, data, max_bytes=None):
+    """Write data under a collision-free name and keep the folder under max_bytes."""
+    name = f"{uuid.uuid4().hex[:12]}_{filename}"
+    with open(os.path.join(folder, name), "wb") as f:
+        f.write(data)
+    if max_bytes:
+        prune_folder(folder, max_bytes, keep=name)
+    return name
+
+
+def prune_folder(folder, max_bytes, keep=None):
+    """Delete the oldest files in folder until its total size is at most max_bytes."""
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.is_file():
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path, entry.name))
+    total = sum(e[1] for e in entries)
+    for _, size, path, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
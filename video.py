@@ -0,0 +1,170 @@
+# video.py
+"""Streaming video fingerprinting on top of EncoderCNN / DecoderCNN.
+
+Frames are read one at a time from cv2.VideoCapture, run through the model in
+batches of ``batch_size`` and written straight to cv2.VideoWriter, so memory
+stays bounded by one batch regardless of clip length. Decoding can sample
+every k-th frame and majority-votes the payload bits across the samples.
+
+    python video.py embed clip.mp4 out.mp4 --username alice
+    python video.py decode out.mp4 --every 10
+"""
+import argparse
+import os
+
+import cv2
+import numpy as np
+import torch
+
+from tiling import TILE_SIZE, encode_tiled
+
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", "8"))
+VIDEO_DECODE_EVERY = int(os.environ.get("VIDEO_DECODE_EVERY", "10"))
+
+
+# --- Frame I/O ---
+def iter_frames(path, every=1, max_frames=None):
+    """Yield (index, RGB uint8 frame) for every ``every``-th frame, one at a time.
+
+    Skipped frames are only grabbed, not decoded.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Failed to open video")
+    try:
+        idx = 0
+        yielded = 0
+        while max_frames is None or yielded < max_frames:
+            if every > 1 and idx % every:
+                if not cap.grab():
+                    break
+                idx += 1
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            yield idx, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            idx += 1
+            yielded += 1
+    finally:
+        cap.release()
+
+
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def frames_to_tensor(frames, device):
+    """List of HxWx3 uint8 RGB frames → (B,3,H,W) float tensor in 0..1."""
+    x = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2)
+    return x.to(device).float().div_(255.0)
+
+
+def video_properties(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Failed to open video")
+    props = {
+        "fps": cap.get(cv2.CAP_PROP_FPS) or 25.0,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "frames": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+    }
+    cap.release()
+    return props
+
+
+# --- Embed / decode ---
+def embed_video(encoder, src, dst, payload, batch_size=VIDEO_BATCH_SIZE, fourcc="mp4v"):
+    """Watermark every frame of src into dst with a (1,P) payload; returns the frame count.
+
+    ``encoder(images, payloads)`` runs on ``payload.device``. Frames larger than
+    TILE_SIZE go through the tiled encoder one at a time.
+    """
+    props = video_properties(src)
+    writer = cv2.VideoWriter(dst, cv2.VideoWriter_fourcc(*fourcc), props["fps"],
+                             (props["width"], props["height"]))
+    if not writer.isOpened():
+        raise ValueError("Failed to open video writer")
+    tiled = max(props["width"], props["height"]) > TILE_SIZE
+    n = 0
+    try:
+        for batch in batched((f for _, f in iter_frames(src)), 1 if tiled else batch_size):
+            with torch.no_grad():
+                if tiled:
+                    x = frames_to_tensor(batch, torch.device("cpu"))
+                    wm = encode_tiled(encoder, x, payload)
+                else:
+                    x = frames_to_tensor(batch, payload.device)
+                    wm = encoder(x, payload.expand(len(batch), -1))
+            out = (wm.permute(0, 2, 3, 1).cpu().numpy() * 255.0).clip(0, 255).astype("uint8")
+            for frame in out:
+                writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            n += len(batch)
+    finally:
+        writer.release()
+    return n
+
+
+def decode_video(decoder, src, every=VIDEO_DECODE_EVERY, batch_size=VIDEO_BATCH_SIZE,
+                 max_frames=None, device=torch.device("cpu")):
+    """Majority-vote payload bits over every ``every``-th frame.
+
+    Returns (bits, info): bits is a (1,P) float tensor of voted 0/1 bits and
+    info has the number of sampled frames and the mean per-bit agreement.
+    """
+    votes = None
+    n = 0
+    for batch in batched((f for _, f in iter_frames(src, every, max_frames)), batch_size):
+        with torch.no_grad():
+            pred = decoder(frames_to_tensor(batch, device))
+        batch_votes = (pred > 0.5).sum(dim=0).cpu()
+        votes = batch_votes if votes is None else votes + batch_votes
+        n += len(batch)
+    if n == 0:
+        raise ValueError("Video has no frames")
+    bits = (votes * 2 > n).float()
+    agreement = (torch.maximum(votes, n - votes).float() / n).mean().item()
+    return bits.unsqueeze(0), {"frames_sampled": n, "bit_agreement": agreement}
+
+
+# --- CLI ---
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint or verify a video clip.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_embed = sub.add_parser("embed")
+    p_embed.add_argument("src")
+    p_embed.add_argument("dst")
+    p_embed.add_argument("--username", default="anonymous")
+    p_embed.add_argument("--batch-size", type=int, default=VIDEO_BATCH_SIZE)
+    p_decode = sub.add_parser("decode")
+    p_decode.add_argument("src")
+    p_decode.add_argument("--every", type=int, default=VIDEO_DECODE_EVERY)
+    p_decode.add_argument("--max-frames", type=int, default=None)
+    p_decode.add_argument("--batch-size", type=int, default=VIDEO_BATCH_SIZE)
+    args = parser.parse_args()
+
+    import service  # model loading and metadata helpers
+    service.load_models()
+
+    if args.command == "embed":
+        meta_bytes = service.encode_metadata_plain(args.username)
+        payload = service.bytes_to_payload_tensor(meta_bytes, service.device)
+        n = embed_video(service.run_encoder_batch, args.src, args.dst, payload, args.batch_size)
+        print(f"Embedded {meta_bytes.decode('utf-8')!r} into {n} frames → {args.dst}")
+    else:
+        bits, info = decode_video(service.run_decoder_batch, args.src, args.every, args.batch_size,
+                                  args.max_frames, service.device)
+        print(f"Decoded {service.payload_tensor_to_string(bits)!r} from {info['frames_sampled']} frames "
+              f"(bit agreement {info['bit_agreement']*100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
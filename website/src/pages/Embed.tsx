@@ -43,14 +43,19 @@ const Embed = () => {
       const res = await fetch("http://127.0.0.1:5000/api/embed", {
         method: "POST",
         body: formData,
+        headers: { Accept: "image/png" },
       });
+      if (!res.ok) {
+        throw new Error(`Embedding failed with status ${res.status}`);
+      }
 
-      const data = await res.json();
+      const blob = await res.blob();
       clearInterval(interval);
 
-      // Flask returns filename + embedded metadata
-      setProcessedImage(`http://127.0.0.1:5000/fingerprinted/${data.fingerprinted_image}`);
-      setEmbeddedMetadata(data.embedded_metadata || null);
+      // Flask streams the fingerprinted image; embedded metadata comes in a header
+      setProcessedImage(URL.createObjectURL(blob));
+      const metadataHeader = res.headers.get("X-Fingerprint-Metadata");
+      setEmbeddedMetadata(metadataHeader ? decodeURIComponent(metadataHeader) : null);
       setProgress(100);
       setState("complete");
     } catch (err) {
@@ -64,7 +69,7 @@ const Embed = () => {
     if (processedImage) {
       const link = document.createElement("a");
       link.href = processedImage;
-      link.download = `fingerprinted_${selectedFile?.name || "image"}`;
+      link.download = `fingerprinted_${(selectedFile?.name || "image").replace(/\.[^.]+$/, "")}.png`;
       link.click();
     }
   };